@@ -0,0 +1,172 @@
+import atexit
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from change_detection import BOOKKEEPING_COLUMNS
+from perf_metrics import span
+from property_store import AUDIT_COLUMNS, KEY_COLUMNS, TABLE_COLUMNS
+
+# Records are written when this many are buffered, or this long after the oldest one arrived
+AUDIT_BATCH_SIZE = int(os.getenv("AUDIT_BATCH_SIZE", "5000"))
+AUDIT_FLUSH_SECONDS = float(os.getenv("AUDIT_FLUSH_SECONDS", "2"))
+# Fields whose changes are recorded; bookkeeping columns change on every save
+AUDITED_COLUMNS = [(name, sql_type) for name, sql_type in TABLE_COLUMNS if name not in KEY_COLUMNS and name not in BOOKKEEPING_COLUMNS]
+
+
+def _missing(values, sql_type):
+    # Like change detection, an empty text counts as no value
+    missing = values.isna()
+    if sql_type not in ("INT", "FLOAT"):
+        missing |= values.astype(object).eq("")
+    return missing.to_numpy()
+
+
+def _as_text(values, sql_type):
+    # Old and new values share one text column; whole numbers are written without ".0"
+    if sql_type == "INT":
+        values = pd.to_numeric(values, errors="coerce").round().astype("Int64")
+    return values.astype(str).where(~_missing(values, sql_type), None)
+
+
+def _differs(new, old, sql_type):
+    new_missing, old_missing = _missing(new, sql_type), _missing(old, sql_type)
+    if sql_type in ("INT", "FLOAT"):
+        same = pd.to_numeric(new, errors="coerce").to_numpy(dtype=float) == pd.to_numeric(old, errors="coerce").to_numpy(dtype=float)
+    else:
+        same = new.astype(str).to_numpy() == old.astype(str).to_numpy()
+    return np.where(new_missing | old_missing, new_missing != old_missing, ~same)
+
+
+def field_changes(previous, written, user, role, changed_at, save_id):
+    # One audit record per changed field of every written row, found column by column.
+    # previous: the rows as they were before the write (UpsertResult.previous, NULL values for
+    # inserted rows); written: the saved frame. Rows missing from previous were not written.
+    written = written.reindex(columns=KEY_COLUMNS + [name for name, _ in AUDITED_COLUMNS])
+    keys = {"Year-Month": str, "Property ID": "int64"}
+    written = written.astype(keys).drop_duplicates(subset=KEY_COLUMNS, keep="last")
+    previous = previous.reindex(columns=written.columns).astype(keys)
+    paired = written.merge(previous, on=KEY_COLUMNS, suffixes=("", "_old"))
+
+    records = []
+    for name, sql_type in AUDITED_COLUMNS:
+        changed = _differs(paired[name], paired[f"{name}_old"], sql_type)
+        if not changed.any():
+            continue
+        rows = paired[changed]
+        records.append(pd.DataFrame({
+            "Year-Month": rows["Year-Month"].to_numpy(),
+            "Property ID": rows["Property ID"].to_numpy(),
+            "Field": name,
+            "Old Value": _as_text(rows[f"{name}_old"], sql_type).to_numpy(),
+            "New Value": _as_text(rows[name], sql_type).to_numpy(),
+        }))
+    if not records:
+        return pd.DataFrame(columns=[name for name, _ in AUDIT_COLUMNS])
+    return pd.concat(records, ignore_index=True).assign(**{
+        "Changed By": user,
+        "Role": role,
+        "Changed At": pd.Timestamp(changed_at),
+        "Save ID": save_id,
+    })
+
+
+class AuditWriter:
+    """Appends audit records to the audit table from a background thread, in batches.
+
+    Save only queues what it wrote and moves on; the field diffs are computed and written here.
+    Failed writes are kept and retried with the next batch.
+    """
+
+    def __init__(self, backend, batch_size=AUDIT_BATCH_SIZE, flush_seconds=AUDIT_FLUSH_SECONDS):
+        self.backend = backend
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.records_written = 0
+        self.records_pending = 0
+        self.error = None
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name=f"audit-writer-{backend.name}", daemon=True)
+        self._thread.start()
+
+    def record(self, previous, written, user, role, save_id):
+        # Called after a batch was committed; returns immediately
+        if len(previous):
+            self._queue.put((previous, written, user, role, pd.Timestamp.now("UTC").tz_localize(None), save_id))
+
+    def flush(self, timeout=None):
+        # Wait until everything queued so far is written (or failed); returns False on timeout
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def stats(self):
+        with self._lock:
+            return {"written": self.records_written, "pending": self.records_pending, "error": self.error}
+
+    def _write(self, pending):
+        records = pd.concat(pending, ignore_index=True)
+        try:
+            with span("audit.write", rows=len(records), backend=self.backend.name):
+                self.backend.append_audit(records)
+        except Exception as e:
+            with self._lock:
+                self.error = str(e)
+            return pending
+        with self._lock:
+            self.records_written += len(records)
+            self.records_pending -= len(records)
+            self.error = None
+        return []
+
+    def _run(self):
+        pending, oldest = [], None
+        while True:
+            timeout = None if oldest is None else max(0.0, oldest + self.flush_seconds - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+            if isinstance(item, threading.Event):
+                if pending:
+                    pending = self._write(pending)
+                item.set()
+            elif item is not None:
+                try:
+                    records = field_changes(*item)
+                except Exception as e:
+                    with self._lock:
+                        self.error = f"Audit records could not be built: {e}"
+                    continue
+                if len(records):
+                    pending.append(records)
+                    with self._lock:
+                        self.records_pending += len(records)
+            if not pending:
+                oldest = None
+                continue
+            oldest = oldest if oldest is not None else time.monotonic()
+            if sum(len(records) for records in pending) >= self.batch_size or time.monotonic() - oldest >= self.flush_seconds:
+                pending = self._write(pending)
+                # Failed records wait a full interval before the next attempt
+                oldest = time.monotonic() if pending else None
+
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+
+def get_audit_writer(backend):
+    # One writer per backend and table per process, flushed when the process exits
+    key = (backend.name, backend.table_name)
+    with _writers_lock:
+        if key not in _writers:
+            writer = AuditWriter(backend)
+            atexit.register(writer.flush, AUDIT_FLUSH_SECONDS * 5)
+            _writers[key] = writer
+        return _writers[key]
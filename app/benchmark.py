@@ -0,0 +1,247 @@
+import argparse
+import io
+import json
+import os
+import platform
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from contextlib import closing
+from datetime import datetime
+
+import pandas as pd
+
+from change_detection import detect_changes
+from exporters import EXCEL_MAX_ROWS, frame_chunks, write_excel_stream, write_sap_text_stream
+from property_store import KEY_COLUMNS, TABLE_COLUMNS, VERSION_COLUMN
+from storage_backends import SQLITE_TYPES, SQLiteBackend
+from synthetic_data import edit_rows, generate_property_data
+
+# Benchmarks of the hot paths (load, filter, diff, export, save) on synthetic data in a local
+# SQLite database, so no Synapse is needed. Results are written as JSON for comparing releases.
+#   python app/benchmark.py --rows 10000 100000 --output bench.json --label 1.4.0
+
+TABLE = "PropertyExport"
+DATA_COLUMNS = [name for name, _ in TABLE_COLUMNS if name not in KEY_COLUMNS]
+# Stamped into every database the benchmark creates (PRAGMA application_id); only those are replaced
+BENCHMARK_APPLICATION_ID = 0x42454E43
+
+
+class NotABenchmarkDatabase(Exception):
+    pass
+
+
+def fresh_database(path):
+    # Every size starts from a new file, so no rollup or audit rows of a previous size are left.
+    # An existing file is only replaced if the benchmark created it.
+    if os.path.exists(path):
+        try:
+            with closing(sqlite3.connect(path)) as conn:
+                application_id = conn.execute("PRAGMA application_id").fetchone()[0]
+        except sqlite3.DatabaseError:
+            application_id = None
+        if application_id != BENCHMARK_APPLICATION_ID:
+            raise NotABenchmarkDatabase(f"{path} was not created by the benchmark, refusing to replace it")
+        os.remove(path)
+    conn = sqlite3.connect(path)
+    conn.execute(f"PRAGMA application_id = {BENCHMARK_APPLICATION_ID}")
+    return conn
+
+
+def create_sqlite_table(conn, frame):
+    columns = ", ".join(f'"{name}" {SQLITE_TYPES[sql_type.split("(")[0]]}' for name, sql_type in TABLE_COLUMNS)
+    conn.execute(f"CREATE TABLE {TABLE} ({columns})")
+    conn.execute(f'CREATE UNIQUE INDEX ix_{TABLE}_key ON {TABLE} ("Year-Month", "Property ID")')
+    frame.to_sql(TABLE, conn, if_exists="append", index=False, chunksize=50000)
+    conn.commit()
+
+
+def save_row_loop(conn, frame):
+    # The original Save: one existence check and one UPDATE or INSERT per row
+    cursor = conn.cursor()
+    for _, row in frame.iterrows():
+        cursor.execute(f'SELECT COUNT(*) FROM {TABLE} WHERE "Year-Month" = ? AND "Property ID" = ?',
+                       (str(row["Year-Month"]), int(row["Property ID"])))
+        if cursor.fetchone()[0] > 0:
+            cursor.execute(f"""
+                UPDATE {TABLE} SET "Property Name" = ?, "Unit Count" = ?, "Occupancy Rate" = ?,
+                    "Total Rent" = ?, "Comment" = ?, "Last Modified By" = ?, "Edited" = ?
+                WHERE "Year-Month" = ? AND "Property ID" = ?""",
+                (str(row["Property Name"]), int(row["Unit Count"]), float(row["Occupancy Rate"]),
+                 float(row["Total Rent"]), str(row["Comment"]), "benchmark", True,
+                 str(row["Year-Month"]), int(row["Property ID"])))
+        else:
+            cursor.execute(f"INSERT INTO {TABLE} VALUES ({', '.join('?' for _ in TABLE_COLUMNS)})",
+                           (str(row["Year-Month"]), int(row["Property ID"]), str(row["Property Name"]),
+                            int(row["Unit Count"]), float(row["Occupancy Rate"]), float(row["Total Rent"]),
+                            str(row["Comment"]), "benchmark", True, None, None))
+    conn.rollback()
+
+
+def save_bulk(conn, frame):
+    # Set-based upsert, the SQLite counterpart of the staging table + MERGE used against Synapse
+    columns = [name for name, _ in TABLE_COLUMNS if name in frame.columns]
+    updates = ", ".join(f'"{name}" = excluded."{name}"' for name in columns if name not in KEY_COLUMNS)
+    rows = frame[columns].astype(object).where(frame[columns].notna(), None).itertuples(index=False, name=None)
+    conn.executemany(
+        f"""INSERT INTO {TABLE} ({", ".join(f'"{name}"' for name in columns)})
+            VALUES ({", ".join("?" for _ in columns)})
+            ON CONFLICT ("Year-Month", "Property ID") DO UPDATE SET {updates}""",
+        list(rows),
+    )
+    conn.rollback()
+
+
+def measure(name, rows, repeat, func):
+    timings = []
+    info = {}
+    for _ in range(repeat):
+        started = time.perf_counter()
+        info = func() or {}
+        timings.append(time.perf_counter() - started)
+    best = min(timings)
+    result = {
+        "benchmark": name,
+        "rows": rows,
+        "repeat": repeat,
+        "best_seconds": round(best, 6),
+        "median_seconds": round(statistics.median(timings), 6),
+        "rows_per_second": round(rows / best) if best else None,
+    }
+    result.update(info)
+    print(f"  {name:<22} {rows:>10,} rows  {best:9.3f}s  {result['rows_per_second'] or 0:>12,} rows/s", file=sys.stderr)
+    return result
+
+
+def run_size(total_rows, args, sqlite_dir):
+    print(f"{total_rows:,} rows:", file=sys.stderr)
+    sqlite_path = os.path.join(sqlite_dir, f"benchmark_{total_rows}.db")
+    conn = fresh_database(sqlite_path)
+    frame = generate_property_data(total_rows, months=args.months, seed=args.seed)
+    create_sqlite_table(conn, frame)
+    results = []
+    month = frame["Year-Month"].iloc[0]
+    property_id = int(frame["Property ID"].iloc[0])
+    month_rows = int((frame["Year-Month"] == month).sum())
+
+    loaded = {}
+
+    def load():
+        loaded["df"] = pd.read_sql(f"SELECT * FROM {TABLE}", conn)
+        return {"bytes": int(loaded["df"].memory_usage(deep=True).sum())}
+
+    results.append(measure("load_select_all", total_rows, args.repeat, load))
+    df = loaded["df"]
+
+    results.append(measure("load_one_month", month_rows, args.repeat, lambda: {
+        "bytes": int(pd.read_sql(f'SELECT * FROM {TABLE} WHERE "Year-Month" = ?', conn, params=(month,)).memory_usage(deep=True).sum())
+    }))
+
+    def filter_frame():
+        filtered = df.copy()
+        filtered = filtered[filtered["Year-Month"] == month]
+        filtered = filtered[filtered["Property ID"] == property_id]
+        return {"matching_rows": len(filtered)}
+
+    results.append(measure("pandas_filter", total_rows, args.repeat, filter_frame))
+
+    edited = edit_rows(df, args.edited_rows, seed=args.seed)
+    results.append(measure("diff", total_rows, args.repeat, lambda: {
+        "changed_rows": len(detect_changes(df, edited).updated)
+    }))
+
+    if total_rows <= min(args.max_excel_rows, EXCEL_MAX_ROWS):
+        def legacy_excel():
+            output = io.BytesIO()
+            df.to_excel(output, index=False)
+            return {"bytes": output.tell()}
+
+        def streamed_excel():
+            output = write_excel_stream(frame_chunks(df), max_bytes=float("inf"))
+            size = output.seek(0, os.SEEK_END)
+            output.close()
+            return {"bytes": size}
+
+        results.append(measure("export_excel_to_excel", total_rows, args.repeat, legacy_excel))
+        results.append(measure("export_excel_stream", total_rows, args.repeat, streamed_excel))
+
+    results.append(measure("export_csv", total_rows, args.repeat, lambda: {
+        "bytes": len(df.to_csv(index=False).encode("utf-8"))
+    }))
+
+    def sap_text():
+        output = write_sap_text_stream(frame_chunks(df), max_bytes=float("inf"))
+        size = output.seek(0, os.SEEK_END)
+        output.close()
+        return {"bytes": size}
+
+    results.append(measure("export_sap_text", total_rows, args.repeat, sap_text))
+
+    save_frame = edited.iloc[:args.save_rows]
+    results.append(measure("save_row_loop", len(save_frame), args.repeat, lambda: save_row_loop(conn, save_frame)))
+    results.append(measure("save_bulk_upsert", len(save_frame), args.repeat, lambda: save_bulk(conn, save_frame)))
+
+    # The app's write path through the storage backend interface (staging table + one upsert, committed)
+    conn.close()
+    backend = SQLiteBackend(sqlite_path, TABLE)
+    loaded_version = [0]
+
+    def backend_upsert():
+        # Every run saves against the version written by the previous one, so no run conflicts
+        result = backend.bulk_upsert(save_frame.assign(Edited=True, **{VERSION_COLUMN: loaded_version[0]}), "benchmark")
+        loaded_version[0] += 1
+        return {"updates": result.updates_count, "inserts": result.inserts_count, "conflicts": len(result.conflicts)}
+
+    results.append(measure("save_backend_upsert", len(save_frame), args.repeat, backend_upsert))
+    results.append(measure("load_backend_month", month_rows, args.repeat, lambda: {
+        "bytes": int(backend.read_frame(month).memory_usage(deep=True).sum())
+    }))
+
+    for result in results:
+        result["table_rows"] = total_rows
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark load, filter, diff, export and save on synthetic data.")
+    parser.add_argument("--rows", type=int, nargs="+", default=[10000, 100000], help="Table sizes to benchmark")
+    parser.add_argument("--months", type=int, help="Number of months to spread the rows over (default: 10 000 properties per month)")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per benchmark, the best and median are reported")
+    parser.add_argument("--edited-rows", type=int, default=30, help="Rows changed in the grid for the diff benchmark")
+    parser.add_argument("--save-rows", type=int, default=1000, help="Rows written by the save benchmarks")
+    parser.add_argument("--max-excel-rows", type=int, default=200000, help="Skip the Excel benchmarks above this size")
+    parser.add_argument("--sqlite-dir", help="Directory for the SQLite databases, a new benchmark_<rows>.db per size (default: a temporary directory)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--label", default="", help="Release or branch name stored with the results")
+    parser.add_argument("--output", help="Write the JSON results to this file instead of stdout")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if args.sqlite_dir:
+            os.makedirs(args.sqlite_dir, exist_ok=True)
+        try:
+            results = [result for rows in args.rows for result in run_size(rows, args, args.sqlite_dir or tmp_dir)]
+        except NotABenchmarkDatabase as e:
+            parser.error(str(e))
+
+    report = {
+        "label": args.label,
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "platform": platform.platform(),
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
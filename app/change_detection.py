@@ -0,0 +1,69 @@
+from collections import namedtuple
+
+import pandas as pd
+
+from property_store import KEY_COLUMNS, VERSION_COLUMN, WATERMARK_COLUMN
+
+# Columns that are maintained by the app and never count as a user edit
+BOOKKEEPING_COLUMNS = ["Last Modified By", "Edited", WATERMARK_COLUMN, VERSION_COLUMN]
+
+ChangeSet = namedtuple("ChangeSet", ["inserted", "updated", "deleted", "unchanged"])
+
+
+def _normalize(frame, columns, numeric_columns):
+    # Bring both snapshots to the same dtypes so equal values hash equally,
+    # the grid editor may turn ints into floats or empty strings into None
+    normalized = pd.DataFrame(index=frame.index)
+    for column in columns:
+        values = frame[column] if column in frame.columns else pd.Series(None, index=frame.index, dtype=object)
+        if column in numeric_columns:
+            normalized[column] = pd.to_numeric(values, errors="coerce").astype(float)
+        else:
+            normalized[column] = values.astype(object).where(values.notna(), "").astype(str)
+    return normalized
+
+
+def _row_hashes(frame, value_columns, numeric_columns):
+    keys = pd.DataFrame({
+        "Year-Month": frame["Year-Month"].astype(str).to_numpy(),
+        "Property ID": pd.to_numeric(frame["Property ID"], errors="coerce").to_numpy(),
+    })
+    hashes = pd.util.hash_pandas_object(_normalize(frame, value_columns, numeric_columns), index=False)
+    keys["_hash"] = hashes.to_numpy()
+    keys["_row"] = range(len(frame))
+    return keys
+
+
+def detect_changes(original, edited, value_columns=None):
+    # Classify the rows of the edited grid against the loaded snapshot by (Year-Month, Property ID),
+    # comparing one 64-bit hash per row instead of looping over rows in Python
+    if value_columns is None:
+        value_columns = [
+            column for column in original.columns.union(edited.columns, sort=False)
+            if column not in KEY_COLUMNS and column not in BOOKKEEPING_COLUMNS
+        ]
+    # The loaded snapshot decides how a column is compared
+    numeric_columns = {
+        column for column in value_columns
+        if column in original.columns and pd.api.types.is_numeric_dtype(original[column])
+    }
+    # Rows added in the grid without a key cannot be matched or saved
+    edited = edited[edited["Year-Month"].notna() & edited["Property ID"].notna()]
+
+    merged = _row_hashes(edited, value_columns, numeric_columns).merge(
+        _row_hashes(original, value_columns, numeric_columns),
+        on=KEY_COLUMNS, how="outer", suffixes=("_edited", "_original"), indicator=True,
+    )
+    in_both = merged["_merge"] == "both"
+    same = in_both & (merged["_hash_edited"] == merged["_hash_original"])
+
+    def rows(frame, mask, suffix):
+        positions = merged.loc[mask, f"_row{suffix}"].astype(int).to_numpy()
+        return frame.iloc[positions]
+
+    return ChangeSet(
+        inserted=rows(edited, merged["_merge"] == "left_only", "_edited"),
+        updated=rows(edited, in_both & ~same, "_edited"),
+        deleted=rows(original, merged["_merge"] == "right_only", "_original"),
+        unchanged=rows(edited, same, "_edited"),
+    )
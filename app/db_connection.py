@@ -0,0 +1,169 @@
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+import pyodbc
+from dotenv import load_dotenv
+
+from perf_metrics import span
+
+
+def load_synapse_settings():
+    # Read the Synapse connection settings from the environment (.env supported)
+    load_dotenv()
+    env = os.getenv("SYNAPSE_ENV", "dev")
+    return {
+        "server": os.getenv("SYNAPSE_SERVER", f"weu-ndw-{env}-asa.sql.azuresynapse.net"),
+        "username": os.getenv("SYNAPSE_USERNAME", "NDWAdminASA"),
+        "database": os.getenv("SYNAPSE_DATABASE", f"weu_ndw_{env}"),
+        "password": os.getenv("SYNAPSE_PASSWORD"),
+        "table_name": os.getenv("SYNAPSE_TABLE", "[dbo].[PropertyExport]"),
+    }
+
+
+class ConnectionManager:
+    """Bounded pool of pyodbc connections shared by all sessions of the process."""
+
+    def __init__(self, settings, pool_size=None, checkout_timeout=30, max_idle_seconds=600, health_check_after=30):
+        self.settings = settings
+        self.pool_size = pool_size or int(os.getenv("SYNAPSE_POOL_SIZE", "8"))
+        self.checkout_timeout = checkout_timeout
+        self.max_idle_seconds = max_idle_seconds
+        self.health_check_after = health_check_after
+        # Idle connections as (connection, last_used) tuples
+        self._idle = queue.LifoQueue()
+        # Limits the number of connections open at the same time
+        self._slots = threading.BoundedSemaphore(self.pool_size)
+        self._table_cache = {}
+        # Tables whose schema has been created/upgraded by this process
+        self._schema_ready = set()
+        self._table_cache_lock = threading.Lock()
+
+    def connection_string(self):
+        s = self.settings
+        return (
+            f"DRIVER={{ODBC Driver 17 for SQL Server}};SERVER={s['server']};"
+            f"DATABASE={s['database']};UID={s['username']};PWD={s['password']}"
+        )
+
+    def _open(self):
+        with span("db.connect", server=self.settings["server"]):
+            return pyodbc.connect(self.connection_string())
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _is_healthy(self, conn, idle_for):
+        # Only ping connections that have been idle for a while, recently used ones are trusted
+        if idle_for < self.health_check_after:
+            return True
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchone()
+            cursor.close()
+            return True
+        except Exception:
+            return False
+
+    def _checkout(self):
+        while True:
+            try:
+                conn, last_used = self._idle.get_nowait()
+            except queue.Empty:
+                return self._open()
+            idle_for = time.monotonic() - last_used
+            if idle_for > self.max_idle_seconds or not self._is_healthy(conn, idle_for):
+                # Stale connection, drop it and try the next one
+                self._close_quietly(conn)
+                continue
+            return conn
+
+    @contextmanager
+    def connection(self):
+        # Borrow a pooled connection; it is returned to the pool on success and discarded on error
+        if not self._slots.acquire(timeout=self.checkout_timeout):
+            raise TimeoutError(f"No database connection available within {self.checkout_timeout} seconds")
+        conn = None
+        try:
+            conn = self._checkout()
+            conn.autocommit = False
+            yield conn
+        except Exception:
+            if conn is not None:
+                self._close_quietly(conn)
+                conn = None
+            raise
+        finally:
+            if conn is not None:
+                try:
+                    # Never hand out a connection with an open transaction
+                    conn.rollback()
+                    conn.autocommit = False
+                    self._idle.put((conn, time.monotonic()))
+                except Exception:
+                    self._close_quietly(conn)
+            self._slots.release()
+
+    def table_exists(self, table_name, refresh=False):
+        # Existence is cached per process, tables are not dropped while the app runs
+        with self._table_cache_lock:
+            if not refresh and self._table_cache.get(table_name):
+                return True
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f"""
+                IF OBJECT_ID('{table_name}', 'U') IS NOT NULL
+                    SELECT 1
+                ELSE
+                    SELECT 0
+            """)
+            exists = cursor.fetchone()[0] == 1
+            cursor.close()
+        # Only positive results are cached so a table created elsewhere is picked up
+        if exists:
+            self.mark_table_exists(table_name)
+        return exists
+
+    def mark_table_exists(self, table_name):
+        with self._table_cache_lock:
+            self._table_cache[table_name] = True
+
+    def schema_ready(self, table_name):
+        with self._table_cache_lock:
+            return table_name in self._schema_ready
+
+    def mark_schema_ready(self, table_name):
+        with self._table_cache_lock:
+            self._schema_ready.add(table_name)
+            self._table_cache[table_name] = True
+
+    def close_all(self):
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._close_quietly(conn)
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_connection_manager(settings=None):
+    # Process-wide manager, rebuilt only when the connection settings change
+    global _manager
+    settings = settings or load_synapse_settings()
+    with _manager_lock:
+        if _manager is None or _manager.settings != settings:
+            if _manager is not None:
+                _manager.close_all()
+            _manager = ConnectionManager(settings)
+        return _manager
@@ -0,0 +1,122 @@
+import argparse
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from exporters import EXPORT_CHUNK_SIZE, csv_chunks, export_filename, sap_text_chunks, write_excel_stream
+from storage_backends import get_storage_backend
+
+# Headless batch export: one file per Year-Month, exported by a pool of worker processes.
+#   python app/export.py --format xlsx --output-dir exports
+#   python app/export.py --format txt --months 2025-04 2025-05 --zip sap_exports.zip
+
+FORMATS = ["xlsx", "csv", "txt"]
+
+
+def export_month(year_month, fmt, output_dir, property_id=None, chunk_size=EXPORT_CHUNK_SIZE):
+    # Runs in a worker process, which opens its own connections
+    started = time.perf_counter()
+    path = os.path.join(output_dir, export_filename(fmt, year_month))
+    rows = 0
+
+    def counted(chunks):
+        nonlocal rows
+        for chunk in chunks:
+            rows += len(chunk)
+            yield chunk
+
+    backend = get_storage_backend()
+    try:
+        with open(path, "wb") as f:
+            chunks = counted(backend.read_chunks(year_month, property_id, chunk_size))
+            if fmt == "xlsx":
+                # The size cap protects the app server, batch exports only have Excel's row limit
+                write_excel_stream(chunks, f, max_bytes=float("inf"))
+            else:
+                writer = csv_chunks if fmt == "csv" else sap_text_chunks
+                for data in writer(chunks):
+                    f.write(data)
+    except Exception:
+        if os.path.exists(path):
+            os.remove(path)
+        raise
+    return {
+        "year_month": year_month,
+        "path": path,
+        "rows": rows,
+        "seconds": time.perf_counter() - started,
+        "bytes": os.path.getsize(path),
+        "worker": os.getpid(),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export PropertyExport data per Year-Month without the Streamlit UI.")
+    parser.add_argument("--format", choices=FORMATS, default="xlsx", help="Export format (default: xlsx)")
+    parser.add_argument("--months", nargs="+", help="Year-Month values to export (default: every month in the table)")
+    parser.add_argument("--property-id", type=int, help="Only export this property")
+    parser.add_argument("--output-dir", default=".", help="Directory for the exported files (default: current directory)")
+    parser.add_argument("--zip", help="Write all files into this ZIP archive instead of separate files")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Number of worker processes")
+    parser.add_argument("--chunk-size", type=int, default=EXPORT_CHUNK_SIZE, help="Rows fetched per database round trip")
+    args = parser.parse_args(argv)
+
+    backend = get_storage_backend()
+    if not backend.configured:
+        parser.error("SYNAPSE_PASSWORD environment variable not set.")
+
+    months = args.months or backend.distinct_values("Year-Month")
+    backend.close()
+    if not months:
+        print(f"No data found in {backend.table_name}.")
+        return 0
+
+    work_dir = tempfile.mkdtemp(prefix="property_export_") if args.zip else args.output_dir
+    os.makedirs(work_dir, exist_ok=True)
+    archive = zipfile.ZipFile(args.zip, "w", zipfile.ZIP_DEFLATED) if args.zip else None
+    started = time.perf_counter()
+    total_rows = 0
+    failures = 0
+    try:
+        # Spawned workers do not inherit this process's database connections
+        with ProcessPoolExecutor(max_workers=max(1, min(args.workers, len(months))),
+                                 mp_context=multiprocessing.get_context("spawn")) as pool:
+            futures = {
+                pool.submit(export_month, month, args.format, work_dir, args.property_id, args.chunk_size): month
+                for month in months
+            }
+            for future in as_completed(futures):
+                month = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    failures += 1
+                    print(f"{month}: export failed: {e}", file=sys.stderr)
+                    continue
+                total_rows += result["rows"]
+                rate = result["rows"] / result["seconds"] if result["seconds"] else 0
+                print(f"{month}: {result['rows']:,} rows in {result['seconds']:.1f}s "
+                      f"({rate:,.0f} rows/s, worker {result['worker']}) -> {os.path.basename(result['path'])}")
+                if archive is not None:
+                    # Files are added as they finish, so the archive never holds more than one in memory
+                    archive.write(result["path"], arcname=os.path.basename(result["path"]))
+                    os.remove(result["path"])
+    finally:
+        if archive is not None:
+            archive.close()
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    seconds = time.perf_counter() - started
+    target = args.zip or os.path.abspath(work_dir)
+    print(f"Exported {total_rows:,} rows from {len(months) - failures} of {len(months)} months "
+          f"in {seconds:.1f}s to {target}.")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
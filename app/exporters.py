@@ -0,0 +1,264 @@
+import json
+import math
+import os
+import tempfile
+import zlib
+from collections import namedtuple
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from openpyxl import Workbook
+
+from property_store import TABLE_COLUMNS, VERSION_COLUMN, WATERMARK_COLUMN
+
+# Column order of the grid and of every export
+EXPORT_COLUMNS = [name for name, _ in TABLE_COLUMNS if name not in (WATERMARK_COLUMN, VERSION_COLUMN)]
+EXPORT_CHUNK_SIZE = 10000
+# Excel worksheets hold at most 1,048,576 rows including the header
+EXCEL_MAX_ROWS = 1048575
+# Exports larger than this on the app server are refused, override with EXPORT_MAX_MB
+EXPORT_MAX_BYTES = int(float(os.getenv("EXPORT_MAX_MB", "200")) * 1024 * 1024)
+# Export output stays in memory up to this size and is spooled to a temp file beyond it
+SPOOL_MEMORY_BYTES = 8 * 1024 * 1024
+# The Excel size is projected while rows are written: the compression ratio is measured on this
+# much worksheet XML, and exports projected above the limit by more than the margin stop early.
+# The exact size is still checked after saving.
+EXCEL_SIZE_SAMPLE_BYTES = 1024 * 1024
+EXCEL_SIZE_MARGIN = 1.1
+
+
+# One field of the SAP text layout. decimals=None marks a text field; numeric fields are
+# written with a fixed number of decimals and zero-padded when fill is "0"
+SapField = namedtuple("SapField", ["column", "width", "align", "fill", "decimals"], defaults=["left", " ", None])
+
+DEFAULT_SAP_LAYOUT = {
+    "fields": [
+        SapField("Year-Month", 7),
+        SapField("Property ID", 10, "right", "0", 0),
+        SapField("Property Name", 40),
+        SapField("Unit Count", 6, "right", "0", 0),
+        SapField("Occupancy Rate", 7, "right", "0", 4),
+        SapField("Total Rent", 15, "right", "0", 2),
+        SapField("Comment", 60),
+    ],
+    # None writes fixed-width records, a character such as ";" writes delimited records
+    "delimiter": None,
+    "encoding": "cp1252",
+    "line_ending": "\r\n",
+}
+
+
+class ExportTooLarge(Exception):
+    pass
+
+
+class SapValueTooWide(Exception):
+    # A number longer than its SAP field; numbers are never cut short
+    pass
+
+
+def export_filename(extension, year_month=None, prefix="property_export"):
+    # property_export_YYYY-MM, named after the exported month when there is exactly one
+    ts = year_month or datetime.now().strftime("%Y-%m")
+    return f"{prefix}_{ts}.{extension}"
+
+
+def frame_chunks(frame, chunk_size=EXPORT_CHUNK_SIZE):
+    # Slices of an in-memory frame, without copying the whole frame at once
+    for start in range(0, len(frame), chunk_size):
+        yield frame.iloc[start:start + chunk_size]
+
+
+def _keys(frame):
+    return pd.MultiIndex.from_arrays([frame["Year-Month"].astype(str), pd.to_numeric(frame["Property ID"]).astype("int64")])
+
+
+def with_grid_edits(chunks, original, edited):
+    # Stored rows with the page shown in the grid (original) replaced by the grid as edited.
+    # Chunks and page are sorted by key and a page is one contiguous key range, so the grid
+    # rows go where the page was.
+    page_keys = _keys(original)
+    placed = False
+    for chunk in chunks:
+        on_page = _keys(chunk).isin(page_keys)
+        if on_page.any() and not placed:
+            first = int(on_page.argmax())
+            yield chunk.iloc[:first]
+            yield edited
+            chunk, on_page = chunk.iloc[first:], on_page[first:]
+            placed = True
+        yield chunk[~on_page]
+    if not placed:
+        yield edited
+
+
+def _chunk_rows(chunk, columns):
+    # Rows of a chunk as tuples in export column order, with NaN/NA written as empty cells
+    values = chunk.reindex(columns=columns)
+    values = values.astype(object).where(values.notna(), None)
+    return values.itertuples(index=False, name=None)
+
+
+def csv_chunks(chunks, columns=EXPORT_COLUMNS):
+    # Encoded CSV for each DataFrame chunk, the header is written once
+    header = True
+    for chunk in chunks:
+        yield chunk.reindex(columns=columns).to_csv(index=False, header=header).encode("utf-8")
+        header = False
+    if header:
+        yield (",".join(columns) + "\n").encode("utf-8")
+
+
+def write_csv_stream(chunks, output=None, columns=EXPORT_COLUMNS, max_bytes=None):
+    # Write the CSV export chunk by chunk, returns the output file positioned at the start
+    max_bytes = EXPORT_MAX_BYTES if max_bytes is None else max_bytes
+    if output is None:
+        output = tempfile.SpooledTemporaryFile(max_size=SPOOL_MEMORY_BYTES)
+    size = 0
+    for data in csv_chunks(chunks, columns):
+        size += len(data)
+        if size > max_bytes:
+            output.close()
+            raise ExportTooLarge(f"Export is larger than the limit of {max_bytes / 1024 / 1024:.0f} MB")
+        output.write(data)
+    output.seek(0)
+    return output
+
+
+def write_excel_stream(chunks, output=None, columns=EXPORT_COLUMNS, max_rows=EXCEL_MAX_ROWS, max_bytes=None):
+    # Write DataFrame chunks to an XLSX workbook in write-only mode, so rows are serialized
+    # as they arrive instead of building every cell object in memory first.
+    # Returns the output file positioned at the start.
+    max_bytes = EXPORT_MAX_BYTES if max_bytes is None else max_bytes
+    if output is None:
+        output = tempfile.SpooledTemporaryFile(max_size=SPOOL_MEMORY_BYTES)
+
+    workbook = Workbook(write_only=True)
+    worksheet = workbook.create_sheet("Sheet1")
+    worksheet.append(list(columns))
+    row_count = 0
+    ratio = None
+    try:
+        for chunk in chunks:
+            row_count += len(chunk)
+            if row_count > max_rows:
+                raise ExportTooLarge(f"Export has more than {max_rows} rows, narrow the filters or export CSV instead")
+            for row in _chunk_rows(chunk, columns):
+                worksheet.append(row)
+            # openpyxl streams the rows into an uncompressed XML temp file, which is deflated on save
+            xml_path = getattr(getattr(worksheet, "_writer", None), "out", None)
+            if math.isinf(max_bytes) or not xml_path:
+                continue
+            xml_size = os.path.getsize(xml_path)
+            if ratio is None and xml_size >= EXCEL_SIZE_SAMPLE_BYTES:
+                with open(xml_path, "rb") as f:
+                    sample = f.read(EXCEL_SIZE_SAMPLE_BYTES)
+                ratio = len(zlib.compress(sample, 6)) / len(sample)
+            if ratio is not None and xml_size * ratio > max_bytes * EXCEL_SIZE_MARGIN:
+                raise ExportTooLarge(f"Export would be about {xml_size * ratio / 1024 / 1024:.1f} MB, "
+                                     f"the limit is {max_bytes / 1024 / 1024:.1f} MB")
+    except Exception:
+        # save() would have removed openpyxl's temp XML file, a refused export removes it here
+        writer = getattr(worksheet, "_writer", None)
+        try:
+            worksheet.close()
+        finally:
+            if writer is not None and os.path.exists(writer.out):
+                writer.cleanup()
+        raise
+    workbook.save(output)
+
+    size = output.tell()
+    if size > max_bytes:
+        output.close()
+        raise ExportTooLarge(f"Export is {size / 1024 / 1024:.0f} MB, the limit is {max_bytes / 1024 / 1024:.0f} MB")
+    output.seek(0)
+    return output
+
+
+def load_sap_layout(path=None):
+    # Layout from a JSON file (SAP_LAYOUT_FILE), falling back to DEFAULT_SAP_LAYOUT
+    path = path or os.getenv("SAP_LAYOUT_FILE")
+    if not path:
+        return DEFAULT_SAP_LAYOUT
+    with open(path, encoding="utf-8") as f:
+        config = json.load(f)
+    layout = dict(DEFAULT_SAP_LAYOUT)
+    layout.update({key: value for key, value in config.items() if key != "fields"})
+    if "fields" in config:
+        layout["fields"] = [SapField(**field) for field in config["fields"]]
+    return layout
+
+
+def _format_sap_field(values, field, delimiter):
+    # Format a whole column at once with vectorized string operations
+    if field.decimals is None:
+        text = values.astype(object).where(values.notna(), "").astype(str)
+        # Line breaks (and the delimiter) would corrupt the record structure
+        text = text.str.replace(r"[\r\n]", " ", regex=True)
+        if delimiter:
+            text = text.str.replace(delimiter, " ", regex=False)
+    else:
+        # Plain floats: the nullable Int32 columns of the compact dtypes would put pd.NA into the masks
+        numbers = pd.to_numeric(values, errors="coerce").astype("float64")
+        missing = numbers.isna()
+        scaled = (numbers.abs().fillna(0) * 10 ** field.decimals).round().astype("int64").astype(str)
+        if field.decimals > 0:
+            scaled = scaled.str.zfill(field.decimals + 1)
+            text = scaled.str[:-field.decimals] + "." + scaled.str[-field.decimals:]
+        else:
+            text = scaled
+        text = pd.Series(np.where(numbers < 0, "-", ""), index=values.index) + text
+        text = text.where(~missing, "")
+        if field.width is not None:
+            too_wide = text.str.len() > field.width
+            if too_wide.any():
+                raise SapValueTooWide(f"{field.column} {values[too_wide].iloc[0]} does not fit the {field.width} characters "
+                                      f"of its SAP field ({int(too_wide.sum())} rows), widen the field in the layout")
+    if delimiter and field.width is None:
+        return text
+    if field.fill == "0" and field.decimals is not None:
+        # zfill keeps the minus sign in front of the padding zeros
+        text = text.where(text == "", text.str.zfill(field.width))
+    if field.align == "right":
+        text = text.str.rjust(field.width, field.fill)
+    else:
+        text = text.str.ljust(field.width, field.fill)
+    if field.decimals is not None:
+        # Missing numbers are left blank rather than written as zero
+        text = text.where(~missing, " " * field.width)
+        return text
+    # Only text is cut to the field width
+    return text.str.slice(0, field.width)
+
+
+def sap_text_chunks(chunks, layout=None):
+    # Encoded SAP text for each DataFrame chunk
+    layout = layout or load_sap_layout()
+    delimiter = layout["delimiter"]
+    for chunk in chunks:
+        if len(chunk) == 0:
+            continue
+        columns = [
+            _format_sap_field(chunk[field.column] if field.column in chunk.columns else pd.Series(None, index=chunk.index, dtype=object), field, delimiter)
+            for field in layout["fields"]
+        ]
+        records = columns[0].str.cat(columns[1:], sep=delimiter or "")
+        yield (layout["line_ending"].join(records.tolist()) + layout["line_ending"]).encode(layout["encoding"], errors="replace")
+
+
+def write_sap_text_stream(chunks, output=None, layout=None, max_bytes=None):
+    # Write the SAP text export chunk by chunk, returns the output file positioned at the start
+    max_bytes = EXPORT_MAX_BYTES if max_bytes is None else max_bytes
+    if output is None:
+        output = tempfile.SpooledTemporaryFile(max_size=SPOOL_MEMORY_BYTES)
+    size = 0
+    for data in sap_text_chunks(chunks, layout):
+        size += len(data)
+        if size > max_bytes:
+            output.close()
+            raise ExportTooLarge(f"Export is larger than the limit of {max_bytes / 1024 / 1024:.0f} MB")
+        output.write(data)
+    output.seek(0)
+    return output
@@ -0,0 +1,59 @@
+import pandas as pd
+
+ARROW_STRING = pd.StringDtype("pyarrow")
+
+# Compact in-memory dtypes of the PropertyExport columns. Repeated values (months, user names)
+# are categorical, free text is Arrow-backed instead of one Python object per cell.
+COMPACT_DTYPES = {
+    "Year-Month": "category",
+    "Property ID": "Int32",
+    "Property Name": ARROW_STRING,
+    "Unit Count": "Int32",
+    "Occupancy Rate": "float64",
+    "Total Rent": "float64",
+    "Comment": ARROW_STRING,
+    "Last Modified By": "category",
+    "Edited": "boolean",
+    "Row Version": "Int32",
+}
+
+
+def apply_compact_dtypes(frame):
+    # Cast the known columns in place of the loaded frame, unknown columns are left alone
+    for column, dtype in COMPACT_DTYPES.items():
+        if column not in frame.columns:
+            continue
+        values = frame[column]
+        if str(values.dtype) == str(dtype):
+            continue
+        if dtype in ("Int32", "float64"):
+            values = pd.to_numeric(values)
+        elif dtype == "category" or dtype == ARROW_STRING:
+            values = values.astype(object).where(values.isna(), values.astype(str))
+        frame[column] = values.astype(dtype)
+    return frame
+
+
+def editable_frame(frame):
+    # The grid needs free-text Year-Month so new rows can use months not yet in the table;
+    # only that column is converted, the other columns are shared with the loaded frame
+    if "Year-Month" in frame.columns and isinstance(frame["Year-Month"].dtype, pd.CategoricalDtype):
+        return frame.assign(**{"Year-Month": frame["Year-Month"].astype(ARROW_STRING)})
+    return frame
+
+
+def memory_report(frames):
+    # Deep memory use per named frame; frames shared under several names are counted once in the total
+    report = {}
+    seen = set()
+    total = 0
+    for name, frame in frames.items():
+        if frame is None:
+            continue
+        size = int(frame.memory_usage(index=True, deep=True).sum())
+        report[name] = size
+        if id(frame) not in seen:
+            seen.add(id(frame))
+            total += size
+    report["total"] = total
+    return report
@@ -0,0 +1,88 @@
+import io
+import os
+from datetime import date
+
+import pandas as pd
+from openpyxl import load_workbook
+
+from change_detection import BOOKKEEPING_COLUMNS
+from property_store import KEY_COLUMNS, TABLE_COLUMNS
+
+# Columns read from an uploaded file, in table order; bookkeeping columns are set by the app
+IMPORT_COLUMNS = [name for name, _ in TABLE_COLUMNS if name not in BOOKKEEPING_COLUMNS]
+IMPORT_CHUNK_SIZE = int(os.getenv("IMPORT_CHUNK_SIZE", "10000"))
+IMPORT_FORMATS = ["csv", "xlsx"]
+
+
+class InvalidImportFile(Exception):
+    pass
+
+
+def _import_frame(frame):
+    # Keep the known columns, in table order; headers are matched without surrounding spaces
+    frame = frame.rename(columns=lambda name: str(name).strip())
+    missing = [name for name in KEY_COLUMNS if name not in frame.columns]
+    if missing:
+        raise InvalidImportFile(f"Missing columns: {', '.join(missing)}. Expected a header row with {', '.join(IMPORT_COLUMNS)}.")
+    return frame.reindex(columns=IMPORT_COLUMNS).dropna(how="all")
+
+
+def csv_chunks(file, chunk_size=IMPORT_CHUNK_SIZE):
+    # Parsed chunk by chunk, everything as text; validation coerces the types.
+    # Yields (chunk, fraction of the file read so far); the index counts the data rows of the file.
+    size = file.seek(0, io.SEEK_END) or 1
+    file.seek(0)
+    reader = pd.read_csv(file, dtype=str, chunksize=chunk_size, encoding="utf-8-sig", keep_default_na=False, na_values=[""])
+    for chunk in reader:
+        yield _import_frame(chunk), min(file.tell() / size, 1.0)
+
+
+def excel_chunks(file, chunk_size=IMPORT_CHUNK_SIZE):
+    # Rows are streamed from the first worksheet in read-only mode, the sheet is never loaded whole.
+    # Yields (chunk, fraction of the sheet read so far).
+    workbook = load_workbook(file, read_only=True, data_only=True)
+    try:
+        sheet = workbook.worksheets[0]
+        rows = sheet.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        header = [f"column {position}" if name is None else name for position, name in enumerate(header)]
+        total_rows = max((sheet.max_row or 0) - 1, 1)
+        rows_read = 0
+        batch = []
+        for row in rows:
+            # Rows shorter than the header (trailing empty cells) are padded so every row has all the columns
+            batch.append(tuple(row[:len(header)]) + (None,) * (len(header) - len(row)))
+            if len(batch) == chunk_size:
+                yield _excel_frame(batch, header, rows_read), min((rows_read + len(batch)) / total_rows, 1.0)
+                rows_read += len(batch)
+                batch = []
+        if batch:
+            yield _excel_frame(batch, header, rows_read), 1.0
+    finally:
+        workbook.close()
+
+
+def _excel_frame(rows, header, first_row):
+    # Numbered on from the previous chunks like the CSV chunks, so the index is the data row of the file
+    # from_records would take an index passed along as field positions, it is set afterwards
+    frame = pd.DataFrame.from_records(rows, columns=header)
+    frame.index = pd.RangeIndex(first_row, first_row + len(rows))
+    frame = _import_frame(frame)
+    # Excel turns 2025-04 into a date unless the cell is formatted as text
+    year_month = frame["Year-Month"]
+    dates = year_month.map(lambda value: isinstance(value, date))
+    if dates.any():
+        # A column of only dates comes back as datetime64, which would turn the text back into dates
+        frame["Year-Month"] = year_month.astype(object).where(~dates, pd.to_datetime(year_month[dates]).dt.strftime("%Y-%m"))
+    return frame
+
+
+def upload_chunks(file, filename, chunk_size=IMPORT_CHUNK_SIZE):
+    extension = os.path.splitext(filename)[1].lower().lstrip(".")
+    if extension == "csv":
+        return csv_chunks(file, chunk_size)
+    if extension == "xlsx":
+        return excel_chunks(file, chunk_size)
+    raise InvalidImportFile(f"Unsupported file type {extension!r}, expected one of {', '.join(IMPORT_FORMATS)}.")
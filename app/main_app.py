@@ -1,22 +1,27 @@
 # filepath: c:\Users\se-tansan01\OneDrive - Stronghold Invest AB\Documents\github-repo\data-export-tool\app\main_app.py
 import streamlit as st
 import pandas as pd
-from datetime import datetime
-import io
-from dotenv import load_dotenv
-import os
-import pyodbc
+from audit_log import get_audit_writer
+from change_detection import detect_changes
+from exporters import export_filename, frame_chunks, with_grid_edits, write_csv_stream, write_excel_stream, write_sap_text_stream
+from frame_schema import apply_compact_dtypes, editable_frame, memory_report
+from importers import IMPORT_CHUNK_SIZE, IMPORT_COLUMNS, IMPORT_FORMATS, InvalidImportFile
+from login_screen import USER_CREDENTIALS
+from perf_metrics import get_metrics_registry, span
+from query_cache import get_query_cache
+from snapshot_cache import get_snapshot_cache
+from property_store import PAGE_SIZE, last_key
+from save_jobs import get_save_job, submit_import_job, submit_save_job
+from storage_backends import get_storage_backend
+from validation import errors, previous_months, validate_frame, warnings
 
-def main_app():
-    # Show login screen if not authenticated
-    if "authenticated" not in st.session_state or not st.session_state["authenticated"]:
-        from login_screen import login_screen
-        login_screen()
-        return
+# Roles that see the performance panel
+PERFORMANCE_PANEL_ROLES = {USER_CREDENTIALS["admin"]["role"], USER_CREDENTIALS["data_engineer"]["role"]}
+# Columns shown in the grid; Modified At and Row Version stay hidden but travel with the rows
+GRID_COLUMNS = ["Year-Month", "Property ID", "Property Name", "Unit Count",
+                "Occupancy Rate", "Total Rent", "Comment", "Last Modified By", "Edited"]
 
-    st.set_page_config(page_title="Property Management Data Export Tool", page_icon="🏢", layout="wide", initial_sidebar_state="collapsed")
-    
-    st.markdown("""
+APP_CSS = """
     <style>
     /* Main layout optimizations */
     section[data-testid="stSidebar"] {display: none;}
@@ -93,42 +98,36 @@ def main_app():
     .stHorizontalBlock {gap: 0.2rem !important;}
     div[data-testid="column"] {padding: 0 !important; margin: 0 !important;}
     </style>
-    """, unsafe_allow_html=True)
-    
-    # Header area with title and logout button using Streamlit's default alignment
-    header_col1, header_col2 = st.columns([6.5, 1.5])
-    
-    with header_col1:
-        st.markdown("""
-        <div style="display: flex; align-items: center; margin-bottom: 0.1rem; padding: 0;">
-            <h2 class="page-title" style="margin: 0; font-size: 1.1em; color: #235390;">🏢 Property Management Export Tool</h2>
-            <span style="color: #666; font-size: 0.8em; margin-left: 1rem;">Welcome, {}</span>
-        </div>
-        """.format(st.session_state.get('username', 'user')), unsafe_allow_html=True)
-    
-    with header_col2:
-        logout_container = st.container()
-        with logout_container:
-            st.markdown('<div style="padding-right: 1rem;">', unsafe_allow_html=True)
-            if st.button("Logout", key="logout_btn", help="Sign out", use_container_width=False):
-                st.session_state.clear()
-                st.rerun()
-            st.markdown('</div>', unsafe_allow_html=True)
-    
-    # Load data
-    load_dotenv()
-    
-    # Define database connection parameters
-    env = os.getenv("SYNAPSE_ENV", "dev")
-    ndw_server = os.getenv("SYNAPSE_SERVER", f"weu-ndw-{env}-asa.sql.azuresynapse.net")
-    ndw_username = os.getenv("SYNAPSE_USERNAME", "NDWAdminASA")
-    ndw_database_name = os.getenv("SYNAPSE_DATABASE", f"weu_ndw_{env}")
-    ndw_password = os.getenv("SYNAPSE_PASSWORD")
-    table_name = os.getenv("SYNAPSE_TABLE", "[dbo].[PropertyExport]")
-      # Default data in case we can't load from database
+    """
+
+
+def main_app():
+    # Show login screen if not authenticated
+    if "authenticated" not in st.session_state or not st.session_state["authenticated"]:
+        from login_screen import login_screen
+        login_screen()
+        return
+
+    st.set_page_config(page_title="Property Management Data Export Tool", page_icon="🏢", layout="wide", initial_sidebar_state="collapsed")
+
+    # The whole script only runs on login, filter and page changes and after a save.
+    # Grid edits, exports and the header rerun just their own fragment.
+    with span("rerun.app"):
+        render_page()
+
+
+@st.cache_resource
+def storage_backend():
+    # Built once per process, so reruns do not read .env or the environment again
+    return get_storage_backend()
+
+
+@st.cache_data
+def sample_data(user):
+    # Default data in case we can't load from database
     # Generate 10 records for April 2025 and 10 for May 2025
     initial_data = []
-    
+
     # April 2025 records
     for i in range(10):
         initial_data.append({
@@ -139,10 +138,10 @@ def main_app():
             "Occupancy Rate": round(0.98 - 0.01 * i, 2),
             "Total Rent": 120000.00 + 1000 * i,
             "Comment": f"April data for unit {i+1}",
-            "Last Modified By": st.session_state.get("username", "admin"),
+            "Last Modified By": user,
             "Edited": False
         })
-    
+
     # May 2025 records
     for i in range(10):
         initial_data.append({
@@ -153,254 +152,639 @@ def main_app():
             "Occupancy Rate": round(0.99 - 0.01 * i, 2),
             "Total Rent": 122000.00 + 1000 * i,
             "Comment": f"May data for unit {i+1}",
-            "Last Modified By": st.session_state.get("username", "admin"),
+            "Last Modified By": user,
             "Edited": False
         })
-    
-    
+
+    return apply_compact_dtypes(pd.DataFrame(initial_data))
+
+
+def render_page():
+    st.markdown(APP_CSS, unsafe_allow_html=True)
+    header()
+
+    # Load data
+    # The storage backend (Synapse or a local SQLite file, see STORAGE_BACKEND) is shared across reruns and sessions
+    storage = storage_backend()
+    table_name = storage.table_name
+
     # Try to load data from Synapse if available
-    df = pd.DataFrame(initial_data)  # Default to initial data
-    
-    if ndw_password:
+    df = sample_data(st.session_state.get("username", "admin"))  # Default to initial data
+    backend = None
+    snapshot = None
+
+    # Reads are served from the process-wide result cache until they expire or Save invalidates them
+    query_cache = get_query_cache()
+
+    def cached_query(key, backend_query, snapshot_query=None, year_month=None):
+        # Cache misses read the local snapshot when there is one, otherwise the storage backend
+        def load():
+            from_snapshot = snapshot is not None and snapshot_query is not None
+            with span(f"load.{key[1]}", source="snapshot" if from_snapshot else backend.name) as timing:
+                result = snapshot_query(snapshot) if from_snapshot else backend_query(backend)
+                if isinstance(result, pd.DataFrame):
+                    timing["rows"] = len(result)
+                    timing["bytes"] = int(result.memory_usage(deep=True).sum())
+            return result
+        return query_cache.get_or_load(key, load, table_name, year_month)
+
+    if storage.configured:
         try:
-            conn = pyodbc.connect(f"DRIVER={{ODBC Driver 17 for SQL Server}};SERVER={ndw_server};DATABASE={ndw_database_name};UID={ndw_username};PWD={ndw_password}")            # Check if the table exists
-            cursor = conn.cursor()
-            table_exists_query = f"""
-                IF OBJECT_ID('{table_name}', 'U') IS NOT NULL
-                    SELECT 1
-                ELSE
-                    SELECT 0
-            """
-            cursor.execute(table_exists_query)
-            table_exists = cursor.fetchone()[0]
-            cursor.close()  # Close the cursor after fetching the result
-            
-            # If table exists, load data from it
-            if table_exists == 1:
-                # Use a new connection for read_sql to avoid cursor conflicts
-                df = pd.read_sql(f"SELECT * FROM {table_name}", conn)
-                st.toast(f"Data loaded successfully", icon="✅")
-            
-            conn.close()
+            if storage.table_exists():
+                backend = storage
+                # The local Parquet snapshot only re-fetches months changed since its last sync
+                snapshot = get_snapshot_cache(table_name, backend.name)
+                if snapshot is not None:
+                    try:
+                        with span("snapshot.sync") as timing:
+                            refreshed_months = snapshot.sync_if_due(backend)
+                            timing["months"] = len(refreshed_months)
+                        if refreshed_months:
+                            query_cache.invalidate(table_name, refreshed_months)
+                    except Exception as e:
+                        st.warning(f"Local snapshot could not be refreshed, reading from the database: {e}")
+                        snapshot = None
+                # Filter options come from cheap DISTINCT queries instead of the full table
+                available_months = cached_query(
+                    (table_name, "distinct", "Year-Month"),
+                    lambda backend: backend.distinct_values("Year-Month"),
+                    lambda snapshot: snapshot.distinct_values("Year-Month"))
+                available_properties = [str(id) for id in cached_query(
+                    (table_name, "distinct", "Property ID"),
+                    lambda backend: backend.distinct_values("Property ID"),
+                    lambda snapshot: snapshot.distinct_values("Property ID"))]
         except Exception as e:
             st.error(f"Failed to connect to database: {e}")
-    
-    # Add filtering capability at the top
+            backend = None
+
+    if backend is None:
+        available_months = sorted(df["Year-Month"].unique().tolist())
+        available_properties = sorted([str(id) for id in df["Property ID"].unique().tolist()])
+
+    # The filter bar is drawn after loading, its last selection is read from the widget state
+    selected_month = st.session_state.get("month_filter", "All")
+    selected_property = st.session_state.get("property_filter", "All")
+    month_param = selected_month if selected_month in available_months else None
+    property_param = int(selected_property) if selected_property in available_properties else None
+
+    # Keyset pagination state: the start key of every page visited, reset whenever the filters change
+    if st.session_state.get("grid_page_filters") != (month_param, property_param):
+        st.session_state.grid_page_filters = (month_param, property_param)
+        st.session_state.grid_page_starts = [None]
+        st.session_state.grid_next_key = None
+
+    if backend is not None:
+        try:
+            # Only the rows of the selected filters and page are sent over the wire
+            after_key = st.session_state.grid_page_starts[-1]
+            filtered_df = cached_query(
+                (table_name, "page", month_param, property_param, after_key, PAGE_SIZE),
+                lambda backend: backend.read_page(month_param, property_param, after_key=after_key),
+                lambda snapshot: snapshot.read_page(month_param, property_param, after_key=after_key),
+                month_param)
+            matching_count, total_count = cached_query(
+                (table_name, "count", month_param, property_param),
+                lambda backend: backend.count_rows(month_param, property_param),
+                lambda snapshot: snapshot.count_rows(month_param, property_param))
+            st.session_state.grid_next_key = last_key(filtered_df) if len(filtered_df) == PAGE_SIZE else None
+            st.toast(f"Data loaded successfully", icon="✅")
+        except Exception as e:
+            st.error(f"Failed to connect to database: {e}")
+            backend = None
+
+    if backend is None:
+        # Local sample data is small enough to filter in memory
+        mask = pd.Series(True, index=df.index)
+        if month_param is not None:
+            mask &= df["Year-Month"] == month_param
+        if property_param is not None:
+            mask &= df["Property ID"] == property_param
+        filtered_df = df[mask]
+        matching_count, total_count = len(filtered_df), len(df)
+        st.session_state.grid_next_key = None
+
+    # Monthly totals come from the rollup table that Save keeps up to date, never from a scan
+    monthly_totals = None
+    if backend is not None:
+        try:
+            monthly_totals = cached_query((table_name, "rollup"), lambda backend: backend.read_rollup())
+        except Exception as e:
+            st.warning(f"Monthly totals could not be loaded: {e}")
+    else:
+        monthly_totals = sample_monthly_totals(df)
+
+    filter_bar(available_months, available_properties, len(filtered_df), matching_count, total_count)
+
+    st.markdown("<hr style='margin: 0.5rem 0; opacity: 0.3;'>", unsafe_allow_html=True)
+    st.markdown("<p style='font-size: 0.8em; color: #666; margin-bottom: 0.2em;'>Edit property data, add comments, then Export/Save. Changed rows are detected automatically.</p>", unsafe_allow_html=True)
+
+    # Store the loaded page for comparison, the grid edits are applied on top of it
+    st.session_state.original_df = filtered_df
+    grid_editor(filtered_df)
+
+    def on_commit(batch):
+        # Cached reads of the saved months (and all-month results) are now stale
+        query_cache.invalidate(table_name, batch["Year-Month"].unique())
+        saved_snapshot = get_snapshot_cache(table_name, storage.name)
+        if saved_snapshot is not None:
+            saved_snapshot.mark_stale()
+
+    def load_reference(months):
+        # Stored rows of the previous months for the month-over-month checks, cached like the grid pages
+        if backend is None:
+            return df[df["Year-Month"].isin(months)]
+        frames = [
+            cached_query((table_name, "month", month),
+                         lambda backend: backend.read_frame(month),
+                         lambda snapshot: snapshot.read_frame(month),
+                         month)
+            for month in months
+        ]
+        return pd.concat(frames, ignore_index=True) if frames else None
+
+    def export_chunks():
+        # Every row of the active filters, not only the page in the grid: the stored rows are streamed
+        # from the database with the page replaced by the grid as edited
+        edited = st.session_state.grid_edit
+        if backend is None:
+            return frame_chunks(edited)
+        return with_grid_edits(backend.read_chunks(month_param, property_param), st.session_state.original_df, edited)
+
+    action_bar(storage, on_commit, load_reference, export_chunks)
+
+    if monthly_totals is not None:
+        monthly_summary(monthly_totals)
+
+    # Bulk corrections from a CSV or Excel file, written by the same background job as Save
+    if storage.configured:
+        import_panel(storage, on_commit)
+
+    # Field-level history of the selected property from the audit table
+    if backend is not None and property_param is not None:
+        edit_history(storage, property_param)
+
+    # Progress of a running save, polled until it finishes
+    if st.session_state.get("save_job_id"):
+        save_job_panel(st.session_state.save_job_id, table_name)
+
+    # Summary of the last finished save
+    if "save_job_summary" in st.session_state:
+        show_save_summary(st.session_state.pop("save_job_summary"), table_name)
+
+    # Edits that lost against a newer version of the row come back for resolution
+    if st.session_state.get("save_conflicts") is not None:
+        mine, theirs = st.session_state.save_conflicts
+        st.warning(f"{len(mine)} rows were changed by someone else after you loaded them and were not saved. "
+                   "Edit your version and save it again, or discard it to keep the current values.")
+        mine_col, theirs_col = st.columns(2)
+        with mine_col:
+            st.caption("Your changes")
+            resolved = st.data_editor(
+                editable_frame(apply_compact_dtypes(mine)),
+                hide_index=True,
+                use_container_width=True,
+                key="conflict_grid",
+                disabled=["Year-Month", "Property ID", "Last Modified By", "Edited"],
+                column_order=GRID_COLUMNS
+            )
+        with theirs_col:
+            st.caption(f"Current values in {table_name}")
+            st.dataframe(apply_compact_dtypes(theirs), hide_index=True, use_container_width=True, column_order=GRID_COLUMNS)
+        keep_col, discard_col, _ = st.columns([1, 1, 4])
+        with keep_col:
+            if st.button("💾 Save my version", key="resolve_keep_btn", use_container_width=True):
+                # Checked like any other save; the rows carry the current Row Version, so they overwrite the newer values
+                if validate_and_save(storage, resolved.assign(Edited=True), on_commit, load_reference):
+                    st.session_state.pop("save_conflicts")
+                    st.rerun()
+        with discard_col:
+            if st.button("↩ Discard mine", key="resolve_discard_btn", use_container_width=True):
+                st.session_state.pop("save_conflicts")
+                st.rerun()
+
+    # Stage timings, cache counters and session memory for administrators
+    if st.session_state.get("user_role") in PERFORMANCE_PANEL_ROLES:
+        with st.expander("⏱ Performance", expanded=False):
+            stage_timings = get_metrics_registry().summary()
+            if stage_timings:
+                st.dataframe(pd.DataFrame(stage_timings), hide_index=True, use_container_width=True)
+            else:
+                st.caption("No timings recorded yet.")
+            cache_stats = query_cache.stats()
+            st.caption(
+                f"Query cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses "
+                f"({cache_stats['hit_rate']:.0%}), {cache_stats['entries']} entries, {cache_stats['bytes'] / 1024:,.0f} KB"
+            )
+            # Memory held by this session's frames; the loaded page is shared with the snapshot and the cache
+            session_memory = memory_report({"loaded page": filtered_df, "original snapshot": st.session_state.original_df, "edited grid": st.session_state.grid_edit})
+            st.caption("Session memory: " + " · ".join(f"{name}: {size / 1024:,.0f} KB" for name, size in session_memory.items()))
+            if storage.configured:
+                audit_stats = get_audit_writer(storage).stats()
+                st.caption(f"Audit writer: {audit_stats['written']:,} records written, {audit_stats['pending']:,} pending"
+                           + (f", last error: {audit_stats['error']}" if audit_stats["error"] else ""))
+
+
+def sample_monthly_totals(frame):
+    # Same shape as the rollup table, computed in memory for the sample data
+    totals = frame.groupby("Year-Month", observed=True).agg(**{
+        "Property Count": ("Property ID", "size"),
+        "Total Rent": ("Total Rent", "sum"),
+        "Average Occupancy Rate": ("Occupancy Rate", "mean"),
+        "Unit Count": ("Unit Count", "sum"),
+    })
+    return totals.reset_index()
+
+
+@st.fragment
+def monthly_summary(monthly_totals):
+    with st.expander("📈 Monthly totals", expanded=False):
+        if monthly_totals.empty:
+            st.caption("Monthly totals are built by the first save.")
+            return
+        st.dataframe(
+            monthly_totals,
+            hide_index=True,
+            use_container_width=True,
+            column_config={
+                "Total Rent": st.column_config.NumberColumn("Total Rent", format="%.2f"),
+                "Average Occupancy Rate": st.column_config.NumberColumn("Average Occupancy Rate", format="%.4f"),
+            }
+        )
+        st.download_button(
+            label="📄 Download totals",
+            data=monthly_totals.to_csv(index=False).encode("utf-8"),
+            file_name=export_filename("csv", prefix="property_monthly_totals"),
+            mime="text/csv",
+            help="Download the monthly totals as CSV",
+            key="download_totals_btn"
+        )
+
+
+@st.fragment
+def import_panel(storage, on_commit):
+    with st.expander("📥 Import file", expanded=False):
+        st.caption(f"CSV or Excel file with a header row: {', '.join(IMPORT_COLUMNS)}. The file is read and validated "
+                   f"in chunks of {IMPORT_CHUNK_SIZE:,} rows. Rows with errors are skipped and listed afterwards, and "
+                   f"imported rows replace existing rows with the same Year-Month and Property ID.")
+        uploaded = st.file_uploader("File to import", type=IMPORT_FORMATS, key="import_file")
+        running = st.session_state.get("save_job_id") is not None
+        if st.button("📥 Import", key="import_btn", disabled=uploaded is None or running, help="Import the file into the table"):
+            try:
+                job = submit_import_job(storage, uploaded, uploaded.name, st.session_state.get("username", "admin"),
+                                        on_commit=on_commit, role=st.session_state.get("user_role"))
+            except InvalidImportFile as e:
+                st.error(f"Import failed: {e}")
+                return
+            st.session_state.save_job_id = job.id
+            # The progress panel lives outside this fragment
+            st.rerun()
+
+
+@st.fragment
+def edit_history(storage, property_id):
+    # Only read when switched on; the toggle reruns just this fragment
+    if not st.toggle(f"🕘 Edit history of property {property_id}", key="edit_history_toggle"):
+        return
+    # The audit records of a save that just finished may still be queued
+    get_audit_writer(storage).flush(timeout=5)
+    try:
+        with span("load.audit", property_id=property_id) as timing:
+            history = storage.read_audit(property_id=property_id)
+            timing["rows"] = len(history)
+    except Exception as e:
+        st.warning(f"Edit history could not be loaded: {e}")
+        return
+    if history.empty:
+        st.caption("No changes recorded for this property yet.")
+        return
+    st.dataframe(
+        history,
+        hide_index=True,
+        use_container_width=True,
+        column_order=["Changed At", "Year-Month", "Field", "Old Value", "New Value", "Changed By", "Role"],
+        column_config={"Changed At": st.column_config.DatetimeColumn("Changed At (UTC)", format="YYYY-MM-DD HH:mm:ss")}
+    )
+
+
+@st.fragment
+def header():
+    # Header area with title and logout button using Streamlit's default alignment
+    header_col1, header_col2 = st.columns([6.5, 1.5])
+
+    with header_col1:
+        st.markdown("""
+        <div style="display: flex; align-items: center; margin-bottom: 0.1rem; padding: 0;">
+            <h2 class="page-title" style="margin: 0; font-size: 1.1em; color: #235390;">🏢 Property Management Export Tool</h2>
+            <span style="color: #666; font-size: 0.8em; margin-left: 1rem;">Welcome, {}</span>
+        </div>
+        """.format(st.session_state.get('username', 'user')), unsafe_allow_html=True)
+
+    with header_col2:
+        logout_container = st.container()
+        with logout_container:
+            st.markdown('<div style="padding-right: 1rem;">', unsafe_allow_html=True)
+            if st.button("Logout", key="logout_btn", help="Sign out", use_container_width=False):
+                st.session_state.clear()
+                st.rerun()
+            st.markdown('</div>', unsafe_allow_html=True)
+
+
+@st.fragment
+def filter_bar(available_months, available_properties, page_rows, matching_count, total_count):
+    # Changing a filter or the page reloads the data, so those trigger a full rerun
     st.markdown("<h3 style='font-size: 1rem; margin-bottom: 0.5rem;'>Filter Data</h3>", unsafe_allow_html=True)
     filter_cols = st.columns([1, 1, 3])
-    
-    # Year-Month filter 
+
+    # Year-Month filter
     with filter_cols[0]:
-        available_months = ["All"] + sorted(df["Year-Month"].unique().tolist())
-        selected_month = st.selectbox("Year-Month", available_months, key="month_filter")
-    
+        selected_month = st.selectbox("Year-Month", ["All"] + available_months, key="month_filter")
+
     # Property ID filter
     with filter_cols[1]:
-        available_properties = ["All"] + sorted([str(id) for id in df["Property ID"].unique().tolist()])
-        selected_property = st.selectbox("Property ID", available_properties, key="property_filter")
-    
-    # Apply filters to dataframe
-    filtered_df = df.copy()
-    if selected_month != "All":
-        filtered_df = filtered_df[filtered_df["Year-Month"] == selected_month]
-    if selected_property != "All":
-        filtered_df = filtered_df[filtered_df["Property ID"] == int(selected_property)]
+        selected_property = st.selectbox("Property ID", ["All"] + available_properties, key="property_filter")
+
+    month_param = None if selected_month == "All" else selected_month
+    property_param = None if selected_property == "All" else int(selected_property)
+    if st.session_state.get("grid_page_filters") != (month_param, property_param):
+        st.rerun()
+
+    page_number = len(st.session_state.grid_page_starts)
+
       # Information about filters applied
     with filter_cols[2]:
-        if selected_month != "All" or selected_property != "All":
-            st.markdown(f"<p style='color: #4f8cff; padding-top: 1.7rem;'><strong>Filtered:</strong> Showing {len(filtered_df)} of {len(df)} records</p>", unsafe_allow_html=True)
-        else:
-            st.markdown("<p style='color: #666; padding-top: 1.7rem;'>No filters applied</p>", unsafe_allow_html=True)
-    
-    st.markdown("<hr style='margin: 0.5rem 0; opacity: 0.3;'>", unsafe_allow_html=True)
-    st.markdown("<p style='font-size: 0.8em; color: #666; margin-bottom: 0.2em;'>Edit property data, add comments, check the 'Edited' box to mark changes, then Export/Save.</p>", unsafe_allow_html=True)
-    
-    # Store the original dataframe for comparison
-    if "original_df" not in st.session_state:
-        st.session_state.original_df = filtered_df.copy()
-    
+        info_col, prev_col, next_col = st.columns([4, 1, 1])
+        with info_col:
+            first_row = (page_number - 1) * PAGE_SIZE + 1 if page_rows else 0
+            page_info = f"rows {first_row}-{first_row + page_rows - 1 if page_rows else 0}"
+            if selected_month != "All" or selected_property != "All":
+                st.markdown(f"<p style='color: #4f8cff; padding-top: 1.7rem;'><strong>Filtered:</strong> Showing {page_info} of {matching_count} matching ({total_count} records)</p>", unsafe_allow_html=True)
+            else:
+                st.markdown(f"<p style='color: #666; padding-top: 1.7rem;'>No filters applied, showing {page_info} of {total_count} records</p>", unsafe_allow_html=True)
+        with prev_col:
+            if st.button("◀", key="prev_page_btn", help="Previous page", disabled=page_number <= 1, use_container_width=True):
+                st.session_state.grid_page_starts.pop()
+                st.rerun()
+        with next_col:
+            if st.button("▶", key="next_page_btn", help="Next page", disabled=st.session_state.grid_next_key is None, use_container_width=True):
+                st.session_state.grid_page_starts.append(st.session_state.grid_next_key)
+                st.rerun()
+
+
+@st.fragment
+def grid_editor(filtered_df):
+    # Every edit reruns only this fragment; the action bar reads the latest grid from the session
     # Data editor with frozen "Edited" column
-    df_edit = st.data_editor(
-        filtered_df,
-        num_rows="dynamic",
-        use_container_width=True,
-        hide_index=True,
-        key="property_grid",
-        height=None,  # This lets the grid adapt to available space
-        disabled=["Property ID", "Last Modified By"],  # Disable editing for these columns
-        column_config={
-            "Edited": st.column_config.CheckboxColumn(
-                "Edited",
-                help="Check this box to mark a row as edited before saving",
-                default=False,
-                required=True
-            ),
-            "Year-Month": st.column_config.TextColumn(
-                "Year-Month",
-                help="Year and month in YYYY-MM format",
-                validate="^[0-9]{4}-[0-9]{2}$"
-            )
-        },
-        column_order=["Year-Month", "Property ID", "Property Name", "Unit Count", 
-                      "Occupancy Rate", "Total Rent", "Comment", "Last Modified By", "Edited"]
-    )
-    
-    # Add a note about marking edits
-    st.markdown("<p style='font-size: 0.75em; color: #ff9900; margin-top: 0.2em;'>⚠️ Important: Check the 'Edited' box for any rows you've modified before saving.</p>", unsafe_allow_html=True)
-    
+    with span("rerun.grid", rows=len(filtered_df), bytes=int(filtered_df.memory_usage(deep=True).sum())):
+        st.session_state.grid_edit = st.data_editor(
+            editable_frame(filtered_df),
+            num_rows="dynamic",
+            use_container_width=True,
+            hide_index=True,
+            key="property_grid",
+            height=None,  # This lets the grid adapt to available space
+            disabled=["Property ID", "Last Modified By", "Edited"],  # Disable editing for these columns
+            column_config={
+                "Edited": st.column_config.CheckboxColumn(
+                    "Edited",
+                    help="Set automatically when a changed row is saved",
+                    default=False
+                ),
+                "Year-Month": st.column_config.TextColumn(
+                    "Year-Month",
+                    help="Year and month in YYYY-MM format",
+                    validate="^[0-9]{4}-[0-9]{2}$"
+                )
+            },
+            column_order=GRID_COLUMNS
+        )
+
+
+def counted(chunks, timing):
+    timing["rows"] = 0
+    for chunk in chunks:
+        timing["rows"] += len(chunk)
+        yield chunk
+
+
+def export_download(kind, label, icon, writer, extension, mime, export_chunks):
+    # Write the rows chunk by chunk; the writer spools them to a temp file, which is read back
+    # for download_button (it needs bytes) and closed
+    st.info(f"Exporting all rows matching the filters to {label}, with your unsaved edits. Changes will not be saved to the database.")
+    try:
+        with span(f"export.{kind}") as timing:
+            output = writer(counted(export_chunks(), timing))
+            data = output.read()
+            output.close()
+            timing["bytes"] = len(data)
+    except Exception as e:
+        st.error(f"{label} export failed: {e}")
+        return
+    # Download inline with action buttons
+    dl_col1, dl_col2, dl_col3, dl_col4, dl_col5 = st.columns([3, 4, 1, 1, 1])
+    with dl_col2:
+        st.markdown('<div class="compact-button">', unsafe_allow_html=True)
+        st.download_button(
+            label=f"{icon} Download {label}",
+            data=data,
+            file_name=export_filename(extension),
+            mime=mime,
+            use_container_width=True,
+            help=f"Download data as {label} file without refreshing",
+            key=f"download_{kind}_btn"
+        )
+        st.markdown('</div>', unsafe_allow_html=True)
+
+
+@st.fragment
+def action_bar(storage, on_commit, load_reference, export_chunks):
+    table_name = storage.table_name
+    df_edit = st.session_state.grid_edit
+
     # --- Action bar: Compact Export and Save buttons at the bottom ---
     st.markdown('<div class="actions-container">', unsafe_allow_html=True)
     # Use a more compact layout with fixed width columns
-    act_col1, act_col2, act_col3, act_col4, act_col5 = st.columns([5, 1, 1, 1, 2])
-    
+    act_col1, act_col2, act_col3, act_col4, act_col5, act_col6 = st.columns([5, 1, 1, 1, 1, 1])
+
     with act_col1:
         st.markdown("<p style='font-weight: 600; margin-top: 2px; white-space: nowrap; font-size: 0.75em;'>Actions:</p>", unsafe_allow_html=True)
-    
+
     with act_col2:
         export_excel = st.button("📊 Excel", key="excel_btn", help="Export to Excel file", use_container_width=True)
-    
+
     with act_col3:
         export_csv = st.button("📄 CSV", key="csv_btn", help="Export to CSV file", use_container_width=True)
-    
+
     with act_col4:
+        export_sap = st.button("📝 SAP", key="sap_btn", help="Export to SAP text file", use_container_width=True)
+
+    with act_col5:
         save = st.button("💾 Save", key="save_btn", type="primary", help="Save to Azure Synapse", use_container_width=True)
-    
+
     st.markdown('</div>', unsafe_allow_html=True)
-      # Handle export and save actions    # Handle excel export
+    # Exports stream every row of the active filters and offer the file next to the action buttons
     if export_excel:
-        # Display message that export is happening without data refresh
-        st.info("Exporting data to Excel without refreshing. Changes will not be saved to the database.")
-        
-        # Create the Excel export from the current data without refreshing
-        output = io.BytesIO()
-        # Use the filtered data for export without any refresh
-        df_edit.to_excel(output, index=False)
-        output.seek(0)
-        ts = datetime.now().strftime("%Y-%m")
-          # Download inline with action buttons
-        dl_col1, dl_col2, dl_col3, dl_col4, dl_col5 = st.columns([3, 4, 1, 1, 1])
-        with dl_col2:
-            st.markdown('<div class="compact-button">', unsafe_allow_html=True)
-            st.download_button(
-                label="📊 Download Excel",
-                data=output,
-                file_name=f"property_export_{ts}.xlsx",
-                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        export_download("excel", "Excel", "📊", write_excel_stream, "xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", export_chunks)
+    if export_csv:
+        # The hidden Modified At and Row Version columns are not exported
+        export_download("csv", "CSV", "📄", write_csv_stream, "csv", "text/csv", export_chunks)
+    if export_sap:
+        export_download("sap", "SAP text", "📝", write_sap_text_stream, "txt", "text/plain", export_chunks)
+
+    if save:
+        # Compare the grid with the loaded snapshot, only inserted and updated rows go to the database
+        with span("save.diff", rows=len(df_edit)) as timing:
+            changes = detect_changes(st.session_state.original_df, df_edit)
+            changed_rows = pd.concat([changes.inserted, changes.updated]).assign(Edited=True)
+            timing["changed_rows"] = len(changed_rows)
+        if len(changes.deleted) > 0:
+            st.warning(f"{len(changes.deleted)} rows removed in the grid are not deleted from {table_name}.")
+
+        if changed_rows.empty:
+            st.info(f"No changes needed to save to {table_name}.")
+        else:
+            if validate_and_save(storage, changed_rows, on_commit, load_reference) and st.session_state.get("pending_save") is None:
+                # The progress panel lives outside this fragment
+                st.rerun()
+
+    if st.session_state.get("pending_save") is not None:
+        pending_rows, anomalies = st.session_state.pending_save
+        st.warning(f"{len(anomalies)} changes differ a lot from the previous month. Check them before saving:")
+        show_violations(anomalies)
+        confirm_col, cancel_col, _ = st.columns([1, 1, 4])
+        with confirm_col:
+            if st.button("💾 Save anyway", key="confirm_save_btn", use_container_width=True):
+                st.session_state.pop("pending_save")
+                if start_save(storage, pending_rows, on_commit):
+                    st.rerun()
+        with cancel_col:
+            if st.button("✖ Cancel", key="cancel_pending_save_btn", use_container_width=True):
+                st.session_state.pop("pending_save")
+                st.rerun(scope="fragment")
+
+
+def show_violations(violations):
+    st.dataframe(
+        violations[["Year-Month", "Property ID", "column", "message"]],
+        hide_index=True,
+        use_container_width=True,
+        column_config={"column": "Column", "message": "Problem"}
+    )
+
+
+def validate_and_save(storage, rows, on_commit, load_reference):
+    # Every rule runs over all rows at once, nothing is written if any row fails. Unusual changes
+    # are kept in pending_save until the user confirms them. Returns False when nothing will be saved.
+    with span("save.validate", rows=len(rows)) as timing:
+        validation = validate_frame(rows, load_reference(previous_months(rows["Year-Month"])))
+        timing["violations"] = len(validation.violations)
+    row_errors = errors(validation.violations)
+    if not row_errors.empty:
+        st.error(f"{len(row_errors)} problems in {row_errors['row'].nunique()} rows must be fixed before saving:")
+        show_violations(row_errors)
+        return False
+    if not storage.configured:
+        st.error("SYNAPSE_PASSWORD environment variable not set.")
+        return False
+    anomalies = warnings(validation.violations)
+    if not anomalies.empty:
+        st.session_state.pending_save = (validation.frame, anomalies)
+        return True
+    return start_save(storage, validation.frame, on_commit)
+
+
+def start_save(storage, rows, on_commit):
+    # The write runs on a background thread in committed batches, the page stays responsive
+    try:
+        job = submit_save_job(storage, rows, st.session_state.get("username", "admin"), on_commit=on_commit,
+                              role=st.session_state.get("user_role"))
+    except Exception as e:
+        st.error(f"Failed to save to {storage.table_name}: {e}")
+        return False
+    st.session_state.save_job_id = job.id
+    return True
+
+
+@st.fragment(run_every=1)
+def save_job_panel(job_id, table_name):
+    job = get_save_job(job_id)
+    if job is None:
+        st.session_state.pop("save_job_id", None)
+        return
+    status = job.status()
+    if job.finished:
+        # Reload the whole page so the grid shows the saved data
+        st.session_state.pop("save_job_id", None)
+        st.session_state.save_job_summary = status
+        if status["kind"] == "import":
+            st.session_state.import_rejected = job.rejected()
+        mine, theirs = job.conflicts()
+        if mine is not None:
+            st.session_state.save_conflicts = (mine, theirs)
+        st.rerun()
+    
+    progress_col, cancel_col = st.columns([6, 1])
+    with progress_col:
+        if status["kind"] == "import":
+            st.progress(status["progress"], text=f"Importing into {table_name}: {status['rows_read']:,} rows read, {status['rows_done']:,} saved, "
+                                                 f"{status['rows_rejected']:,} rejected ({status['rows_per_second']:,.0f} rows/s)")
+        else:
+            st.progress(status["progress"], text=f"Saving to {table_name}: {status['rows_done']:,} of {status['total_rows']:,} rows ({status['batches_committed']} batches committed)")
+    with cancel_col:
+        if st.button("✖ Cancel", key="cancel_save_btn", help="Stop after the current batch", disabled=job.cancel_requested, use_container_width=True):
+            job.cancel()
+
+
+def show_save_summary(status, table_name):
+    if status["kind"] == "import":
+        show_import_summary(status, table_name)
+        return
+    updates_count, inserts_count = status["updates_count"], status["inserts_count"]
+    if status["state"] == "failed":
+        st.error(f"Failed to save to Synapse after {status['rows_done']:,} rows: {status['error']}")
+    elif status["state"] == "cancelled":
+        st.warning(f"Save cancelled: {status['rows_done']:,} of {status['total_rows']:,} rows were saved ({updates_count} updated, {inserts_count} added).")
+    elif updates_count > 0 and inserts_count > 0:
+        st.success(f"Data saved to {table_name}: {updates_count} records updated, {inserts_count} new records added.")
+    elif updates_count > 0:
+        st.success(f"Data saved to {table_name}: {updates_count} records updated.")
+    elif inserts_count > 0:
+        st.success(f"Data saved to {table_name}: {inserts_count} new records added.")
+    elif not status["conflicts_count"]:
+        st.info(f"No changes needed to save to {table_name}.")
+
+
+def show_import_summary(status, table_name):
+    imported = (f"{status['rows_done']:,} of {status['rows_read']:,} rows imported into {table_name} in {status['seconds']:.1f}s "
+                f"({status['rows_per_second']:,.0f} rows/s): {status['inserts_count']:,} added, {status['updates_count']:,} updated")
+    if status["state"] == "failed":
+        st.error(f"Import failed after {status['rows_done']:,} rows: {status['error']}")
+    elif status["state"] == "cancelled":
+        st.warning(f"Import cancelled: {imported}.")
+    else:
+        st.success(f"{imported}.")
+
+    rejected = st.session_state.pop("import_rejected", None)
+    if status["rows_rejected"]:
+        st.warning(f"{status['rows_rejected']:,} rows were skipped because of validation errors:")
+        if rejected is not None:
+            # Row is the data row of the file, not counting the header
+            st.dataframe(
+                rejected.assign(row=rejected["row"] + 1)[["row", "Year-Month", "Property ID", "column", "message"]],
+                hide_index=True,
                 use_container_width=True,
-                help="Download data as Excel file without refreshing",
-                key="download_excel_btn"
+                column_config={"row": "Row", "column": "Column", "message": "Problem"}
             )
-            st.markdown('</div>', unsafe_allow_html=True)
-      # Handle CSV export
-    if export_csv:
-        # Display message that export is happening without data refresh
-        st.info("Exporting data to CSV without refreshing. Changes will not be saved to the database.")
-        
-        # Create the CSV export from the current data without refreshing
-        csv = df_edit.to_csv(index=False).encode('utf-8')
-        ts = datetime.now().strftime("%Y-%m")
-          # Download inline with action buttons
-        dl_col1, dl_col2, dl_col3, dl_col4, dl_col5 = st.columns([3, 4, 1, 1, 1])
-        with dl_col2:
-            st.markdown('<div class="compact-button">', unsafe_allow_html=True)
-            st.download_button(
-                label="📄 Download CSV",
-                data=csv,
-                file_name=f"property_export_{ts}.csv",
-                mime="text/csv",
+
+    if status["batch_stats"]:
+        with st.expander("⏱ Import chunks", expanded=False):
+            st.dataframe(
+                pd.DataFrame(status["batch_stats"]),
+                hide_index=True,
                 use_container_width=True,
-                help="Download data as CSV file without refreshing",
-                key="download_csv_btn"
+                column_config={
+                    "batch": "Chunk",
+                    "rows": "Rows saved",
+                    "seconds": st.column_config.NumberColumn("Seconds", format="%.2f"),
+                    "rows_per_second": st.column_config.NumberColumn("Rows/s", format="%.0f"),
+                }
             )
-            st.markdown('</div>', unsafe_allow_html=True)
-    
-    if save:
-        env = os.getenv("SYNAPSE_ENV", "dev")
-        ndw_server = os.getenv("SYNAPSE_SERVER", f"weu-ndw-{env}-asa.sql.azuresynapse.net")
-        ndw_username = os.getenv("SYNAPSE_USERNAME", "NDWAdminASA")
-        ndw_database_name = os.getenv("SYNAPSE_DATABASE", f"weu_ndw_{env}")
-        ndw_password = os.getenv("SYNAPSE_PASSWORD")
-        table_name = os.getenv("SYNAPSE_TABLE", "[dbo].[PropertyExport]")
-        
-        if not ndw_password:
-            st.error("SYNAPSE_PASSWORD environment variable not set.")
-        else:
-            try:
-                conn = pyodbc.connect(f"DRIVER={{ODBC Driver 17 for SQL Server}};SERVER={ndw_server};DATABASE={ndw_database_name};UID={ndw_username};PWD={ndw_password}")
-                cursor = conn.cursor()
-                conn.autocommit = True
-                cursor.execute(f"""
-                IF OBJECT_ID('{table_name}', 'U') IS NULL
-                CREATE TABLE {table_name} (
-                    [Year-Month] NVARCHAR(7),
-                    [Property ID] INT,
-                    [Property Name] NVARCHAR(255),
-                    [Unit Count] INT,
-                    [Occupancy Rate] FLOAT,
-                    [Total Rent] FLOAT,
-                    [Comment] NVARCHAR(255),
-                    [Last Modified By] NVARCHAR(255),
-                    [Edited] BIT
-                )
-                """)
-                conn.autocommit = False
-                
-                # Process each row in the data editor
-                updates_count = 0
-                inserts_count = 0
-                
-                for _, row in df_edit.iterrows():
-                    # Check if record exists
-                    cursor.execute(f"""
-                        SELECT COUNT(*) FROM {table_name} 
-                        WHERE [Year-Month] = ? AND [Property ID] = ?                    """, str(row["Year-Month"]), int(row["Property ID"]))
-                    record_exists = cursor.fetchone()[0] > 0
-                    
-                    if record_exists and row["Edited"]:
-                        # Update existing record if it was edited and update the Last Modified By field
-                        current_user = st.session_state.get("username", "admin")
-                        
-                        cursor.execute(f"""
-                            UPDATE {table_name} 
-                            SET [Property Name] = ?, 
-                                [Unit Count] = ?, 
-                                [Occupancy Rate] = ?, 
-                                [Total Rent] = ?, 
-                                [Comment] = ?, 
-                                [Last Modified By] = ?, 
-                                [Edited] = ?
-                            WHERE [Year-Month] = ? AND [Property ID] = ?                        """, str(row["Property Name"]), int(row["Unit Count"]), 
-                            float(row["Occupancy Rate"]), float(row["Total Rent"]), 
-                            str(row["Comment"]), current_user,  # Update with current username
-                            bool(row["Edited"]), str(row["Year-Month"]), int(row["Property ID"]))
-                        
-                        if cursor.rowcount > 0:
-                            updates_count += 1
-                    
-                    elif not record_exists:
-                        # Insert if it's a new record
-                        current_user = st.session_state.get("username", "admin")
-                        
-                        cursor.execute(f"""
-                            INSERT INTO {table_name} ([Year-Month], [Property ID], [Property Name], [Unit Count], [Occupancy Rate], [Total Rent], [Comment], [Last Modified By], [Edited])
-                            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-                        """, str(row["Year-Month"]), int(row["Property ID"]), str(row["Property Name"]), 
-                            int(row["Unit Count"]), float(row["Occupancy Rate"]), float(row["Total Rent"]), 
-                            str(row["Comment"]), current_user, bool(row["Edited"]))
-                        
-                        inserts_count += 1
-                
-                conn.commit()
-                conn.close()
-                
-                # Show appropriate success message
-                if updates_count > 0 and inserts_count > 0:
-                    st.success(f"Data saved to {table_name}: {updates_count} records updated, {inserts_count} new records added.")
-                elif updates_count > 0:
-                    st.success(f"Data saved to {table_name}: {updates_count} records updated.")
-                elif inserts_count > 0:
-                    st.success(f"Data saved to {table_name}: {inserts_count} new records added.")
-                else:
-                    st.info(f"No changes needed to save to {table_name}.")
-            except Exception as e:
-                st.error(f"Failed to save to Synapse: {e}")
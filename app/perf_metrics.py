@@ -0,0 +1,90 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import numpy as np
+
+logger = logging.getLogger("property_export.perf")
+# Spans go to stderr as JSON lines (picked up by the App Service log stream), PERF_LOG=0 turns this off
+if os.getenv("PERF_LOG", "1") != "0" and not logger.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter("%(asctime)s %(name)s %(message)s"))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+# Timings kept per stage for the percentiles
+SAMPLES_PER_STAGE = 1000
+
+
+class MetricsRegistry:
+    """In-process timings per stage, shared by all sessions."""
+
+    def __init__(self, samples_per_stage=SAMPLES_PER_STAGE):
+        self.samples_per_stage = samples_per_stage
+        self._stages = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage, seconds, rows=None, size=None):
+        with self._lock:
+            stats = self._stages.get(stage)
+            if stats is None:
+                stats = self._stages[stage] = {"seconds": deque(maxlen=self.samples_per_stage), "count": 0, "rows": 0, "bytes": 0}
+            stats["seconds"].append(seconds)
+            stats["count"] += 1
+            stats["rows"] += rows or 0
+            stats["bytes"] += size or 0
+
+    def summary(self):
+        # One row per stage with p50/p95/max in milliseconds over the recent samples
+        with self._lock:
+            stages = {stage: (list(stats["seconds"]), stats["count"], stats["rows"], stats["bytes"]) for stage, stats in self._stages.items()}
+        rows = []
+        for stage, (seconds, count, total_rows, total_bytes) in sorted(stages.items()):
+            p50, p95 = np.percentile(seconds, [50, 95]) * 1000
+            rows.append({
+                "stage": stage,
+                "count": count,
+                "p50_ms": round(float(p50), 1),
+                "p95_ms": round(float(p95), 1),
+                "max_ms": round(max(seconds) * 1000, 1),
+                "rows": total_rows,
+                "bytes": total_bytes,
+            })
+        return rows
+
+    def reset(self):
+        with self._lock:
+            self._stages.clear()
+
+
+_registry = MetricsRegistry()
+
+
+def get_metrics_registry():
+    return _registry
+
+
+@contextmanager
+def span(stage, **fields):
+    # Time a block; set span["rows"] / span["bytes"] inside it to attach sizes.
+    # Every span is logged as one JSON line and recorded in the registry, failed ones too.
+    attributes = dict(fields)
+    started = time.perf_counter()
+    error = None
+    try:
+        yield attributes
+    except Exception as e:
+        error = type(e).__name__
+        raise
+    finally:
+        seconds = time.perf_counter() - started
+        _registry.record(stage, seconds, attributes.get("rows"), attributes.get("bytes"))
+        record = {"stage": stage, "ms": round(seconds * 1000, 2), **attributes}
+        if error:
+            record["error"] = error
+        logger.info(json.dumps(record, default=str))
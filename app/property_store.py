@@ -0,0 +1,472 @@
+from collections import namedtuple
+
+import pandas as pd
+
+from frame_schema import apply_compact_dtypes
+
+# Column definitions of the PropertyExport table, in table order
+TABLE_COLUMNS = [
+    ("Year-Month", "NVARCHAR(7)"),
+    ("Property ID", "INT"),
+    ("Property Name", "NVARCHAR(255)"),
+    ("Unit Count", "INT"),
+    ("Occupancy Rate", "FLOAT"),
+    ("Total Rent", "FLOAT"),
+    ("Comment", "NVARCHAR(255)"),
+    ("Last Modified By", "NVARCHAR(255)"),
+    ("Edited", "BIT"),
+    ("Modified At", "DATETIME2"),
+    ("Row Version", "INT"),
+]
+KEY_COLUMNS = ["Year-Month", "Property ID"]
+# Set by the database on every insert/update made by the app, used to find changed months incrementally.
+# Writes from outside the app may leave it unchanged, the snapshot also compares month fingerprints.
+WATERMARK_COLUMN = "Modified At"
+# Incremented on every update; Save only updates rows still at the version the user loaded
+VERSION_COLUMN = "Row Version"
+# Columns added after the table was first deployed, added to existing tables by ensure_table
+ADDED_COLUMNS = [WATERMARK_COLUMN, VERSION_COLUMN]
+STAGING_TABLE = "#PropertyExportStaging"
+# Per-month totals kept next to the table and adjusted by every Save; the average occupancy is
+# stored as sum and count so it can be maintained incrementally
+ROLLUP_COLUMNS = [
+    ("Year-Month", "NVARCHAR(7)"),
+    ("Property Count", "INT"),
+    ("Total Rent", "FLOAT"),
+    ("Occupancy Rate Sum", "FLOAT"),
+    ("Occupancy Rate Count", "INT"),
+    ("Unit Count", "BIGINT"),
+    ("Updated At", "DATETIME2"),
+]
+ROLLUP_DELTA_TABLE = "#PropertyExportRollupDelta"
+# Columns returned by read_rollup
+ROLLUP_READ_COLUMNS = ["Year-Month", "Property Count", "Total Rent", "Average Occupancy Rate", "Unit Count"]
+# Append-only field-level history, one row per changed field; rows are only ever inserted
+AUDIT_COLUMNS = [
+    ("Year-Month", "NVARCHAR(7)"),
+    ("Property ID", "INT"),
+    ("Field", "NVARCHAR(64)"),
+    ("Old Value", "NVARCHAR(255)"),
+    ("New Value", "NVARCHAR(255)"),
+    ("Changed By", "NVARCHAR(255)"),
+    ("Role", "NVARCHAR(64)"),
+    ("Changed At", "DATETIME2"),
+    ("Save ID", "NVARCHAR(32)"),
+]
+# One row per table, updated as the first statement of every Save transaction. Concurrent Saves
+# queue on its row lock, so the version check, counts, rollup deltas and audit values they read
+# before the MERGE cannot be invalidated by another Save (Synapse has no BEGIN IMMEDIATE).
+LOCK_COLUMNS = [
+    ("Locked At", "DATETIME2"),
+    ("Locked By", "NVARCHAR(255)"),
+]
+AUDIT_HISTORY_LIMIT = 1000
+INSERT_BATCH_SIZE = 5000
+PAGE_SIZE = 1000
+
+# Result of bulk_upsert; conflicts holds the current table rows of edits made against an older version,
+# previous the keys of every row written with the values it had before (NULL for inserted rows)
+UpsertResult = namedtuple("UpsertResult", ["updates_count", "inserts_count", "conflicts", "previous"])
+
+
+def _column_list(prefix=""):
+    return ", ".join(f"{prefix}[{name}]" for name, _ in TABLE_COLUMNS)
+
+
+def _column_definitions():
+    return ",\n    ".join(f"[{name}] {sql_type}" for name, sql_type in TABLE_COLUMNS)
+
+
+def _merge_value(name, prefix):
+    # The watermark always comes from the database clock, never from the client.
+    # The staged version is the one the user loaded, the written row gets the next one.
+    if name == WATERMARK_COLUMN:
+        return "SYSUTCDATETIME()"
+    if name == VERSION_COLUMN:
+        return f"ISNULL({prefix}[{name}], 0) + 1"
+    return f"{prefix}[{name}]"
+
+
+def _version_matches(target, source):
+    # Rows created before the version column existed count as version 0
+    return f"ISNULL({target}.[{VERSION_COLUMN}], 0) = ISNULL({source}.[{VERSION_COLUMN}], 0)"
+
+
+def rollup_table_name(table_name):
+    # [dbo].[PropertyExport] -> [dbo].[PropertyExportMonthly]
+    return f"{table_name[:-1]}Monthly]" if table_name.endswith("]") else f"{table_name}Monthly"
+
+
+def audit_table_name(table_name):
+    # [dbo].[PropertyExport] -> [dbo].[PropertyExportAudit]
+    return f"{table_name[:-1]}Audit]" if table_name.endswith("]") else f"{table_name}Audit"
+
+
+def lock_table_name(table_name):
+    # [dbo].[PropertyExport] -> [dbo].[PropertyExportLock]
+    return f"{table_name[:-1]}Lock]" if table_name.endswith("]") else f"{table_name}Lock"
+
+
+def _rollup_aggregates(prefix):
+    # Aggregates of the base rows into the rollup columns, without Year-Month and Updated At
+    return [
+        f"ISNULL(SUM({prefix}[Total Rent]), 0)",
+        f"ISNULL(SUM({prefix}[Occupancy Rate]), 0)",
+        f"COUNT({prefix}[Occupancy Rate])",
+        f"ISNULL(SUM(CAST({prefix}[Unit Count] AS BIGINT)), 0)",
+    ]
+
+
+def _table_exists(conn, table_name):
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT OBJECT_ID('{table_name}', 'U')")
+    exists = cursor.fetchone()[0] is not None
+    cursor.close()
+    return exists
+
+
+def ensure_table(cursor, table_name):
+    # Creates or upgrades the table and its rollup, audit and lock tables. Only called on the
+    # write paths (Save, import, audit writes) and by rebuild_rollup, never when reading.
+    cursor.execute(f"""
+    IF OBJECT_ID('{table_name}', 'U') IS NULL
+    CREATE TABLE {table_name} (
+    {_column_definitions()}
+    )
+    """)
+    # Tables created before the watermark and version columns existed get them added
+    column_types = dict(TABLE_COLUMNS)
+    for name in ADDED_COLUMNS:
+        cursor.execute(f"""
+        IF COL_LENGTH('{table_name}', '{name}') IS NULL
+        ALTER TABLE {table_name} ADD [{name}] {column_types[name]} NULL
+        """)
+    # Dedicated SQL pools only accept constant DEFAULTs, so rows inserted outside the app (or before
+    # the column existed) have no watermark; they are stamped here once per process
+    cursor.execute(f"UPDATE {table_name} SET [{WATERMARK_COLUMN}] = SYSUTCDATETIME() WHERE [{WATERMARK_COLUMN}] IS NULL")
+    # The rollup is built from the table once, from then on Save keeps it up to date
+    rollup_table = rollup_table_name(table_name)
+    cursor.execute(f"SELECT OBJECT_ID('{rollup_table}', 'U')")
+    if cursor.fetchone()[0] is None:
+        rollup_definitions = ",\n    ".join(f"[{name}] {sql_type}" for name, sql_type in ROLLUP_COLUMNS)
+        cursor.execute(f"CREATE TABLE {rollup_table} (\n    {rollup_definitions}\n)")
+        rebuild_rollup(cursor, table_name)
+    # The history of a property is read by Property ID, the index keeps that a seek as the table grows
+    audit_table = audit_table_name(table_name)
+    cursor.execute(f"SELECT OBJECT_ID('{audit_table}', 'U')")
+    if cursor.fetchone()[0] is None:
+        audit_definitions = ",\n    ".join(f"[{name}] {sql_type}" for name, sql_type in AUDIT_COLUMNS)
+        cursor.execute(f"CREATE TABLE {audit_table} (\n    {audit_definitions}\n)")
+        index_name = "ix_" + audit_table.split(".")[-1].strip("[]") + "_property"
+        cursor.execute(f"CREATE INDEX [{index_name}] ON {audit_table} ([Property ID], [Year-Month], [Changed At])")
+    lock_table = lock_table_name(table_name)
+    cursor.execute(f"SELECT OBJECT_ID('{lock_table}', 'U')")
+    if cursor.fetchone()[0] is None:
+        lock_definitions = ", ".join(f"[{name}] {sql_type}" for name, sql_type in LOCK_COLUMNS)
+        cursor.execute(f"CREATE TABLE {lock_table} ({lock_definitions})")
+    cursor.execute(f"SELECT COUNT(*) FROM {lock_table}")
+    if cursor.fetchone()[0] == 0:
+        cursor.execute(f"INSERT INTO {lock_table} ([Locked At], [Locked By]) VALUES (SYSUTCDATETIME(), NULL)")
+
+
+def rebuild_rollup(cursor, table_name):
+    # Full recomputation, only needed when the table was changed outside the app
+    rollup_table = rollup_table_name(table_name)
+    cursor.execute(f"DELETE FROM {rollup_table}")
+    cursor.execute(f"""
+        INSERT INTO {rollup_table} ({", ".join(f"[{name}]" for name, _ in ROLLUP_COLUMNS)})
+        SELECT [Year-Month], COUNT(*), {", ".join(_rollup_aggregates(""))}, SYSUTCDATETIME()
+        FROM {table_name}
+        GROUP BY [Year-Month]
+    """)
+
+
+def read_rollup(conn, table_name):
+    # One row per Year-Month straight from the rollup table, no scan of the base table.
+    # The rollup is created by the first Save, before that there are no totals.
+    if not _table_exists(conn, rollup_table_name(table_name)):
+        return pd.DataFrame(columns=ROLLUP_READ_COLUMNS)
+    return pd.read_sql(f"""
+        SELECT [Year-Month], [Property Count], [Total Rent],
+            [Occupancy Rate Sum] / NULLIF([Occupancy Rate Count], 0) AS [Average Occupancy Rate],
+            [Unit Count]
+        FROM {rollup_table_name(table_name)}
+        ORDER BY [Year-Month]
+    """, conn)
+
+
+def _create_temp_tables(cursor):
+    # Synapse rejects CREATE and DROP TABLE inside a user transaction, the connection must be in autocommit mode
+    delta_definitions = ", ".join(f"[{name}] {sql_type}" for name, sql_type in ROLLUP_COLUMNS if name != "Updated At")
+    for temp_table, definitions in [(STAGING_TABLE, _column_definitions()), (ROLLUP_DELTA_TABLE, delta_definitions)]:
+        cursor.execute(f"IF OBJECT_ID('tempdb..{temp_table}') IS NOT NULL DROP TABLE {temp_table}")
+        cursor.execute(f"CREATE TABLE {temp_table} (\n    {definitions}\n)")
+
+
+def _drop_temp_tables(cursor):
+    for temp_table in [STAGING_TABLE, ROLLUP_DELTA_TABLE]:
+        cursor.execute(f"DROP TABLE {temp_table}")
+
+
+def _apply_rollup_deltas(cursor, table_name, key_join, version_matches):
+    # Adjust the monthly totals by the rows the MERGE is about to write: new values minus the
+    # values they replace. Runs before the MERGE, in the same transaction.
+    rollup_table = rollup_table_name(table_name)
+    value_columns = [name for name, _ in ROLLUP_COLUMNS if name not in ("Year-Month", "Updated At")]
+    new_values, old_values = _rollup_aggregates("s."), _rollup_aggregates("t.")
+    cursor.execute(f"""
+        INSERT INTO {ROLLUP_DELTA_TABLE}
+        SELECT s.[Year-Month],
+            SUM(CASE WHEN t.[Property ID] IS NULL THEN 1 ELSE 0 END),
+            {", ".join(f"{new} - {old}" for new, old in zip(new_values, old_values))}
+        FROM {STAGING_TABLE} AS s
+        LEFT JOIN {table_name} AS t ON {key_join}
+        WHERE t.[Property ID] IS NULL OR (s.[Edited] = 1 AND {version_matches})
+        GROUP BY s.[Year-Month]
+    """)
+    cursor.execute(f"""
+        MERGE {rollup_table} AS r
+        USING {ROLLUP_DELTA_TABLE} AS d
+        ON r.[Year-Month] = d.[Year-Month]
+        WHEN MATCHED THEN
+            UPDATE SET
+                {", ".join(f"r.[{name}] = r.[{name}] + d.[{name}]" for name in value_columns)},
+                r.[Updated At] = SYSUTCDATETIME()
+        WHEN NOT MATCHED BY TARGET THEN
+            INSERT ({", ".join(f"[{name}]" for name, _ in ROLLUP_COLUMNS)})
+            VALUES (d.[Year-Month], {", ".join(f"d.[{name}]" for name in value_columns)}, SYSUTCDATETIME());
+    """)
+
+
+def _filter_clauses(year_month=None, property_id=None):
+    # Parameterized WHERE conditions for the grid filters, None means "All"
+    clauses, params = [], []
+    if year_month is not None:
+        clauses.append("[Year-Month] = ?")
+        params.append(str(year_month))
+    if property_id is not None:
+        clauses.append("[Property ID] = ?")
+        params.append(int(property_id))
+    return clauses, params
+
+
+def _where(clauses):
+    return f"WHERE {' AND '.join(clauses)}" if clauses else ""
+
+
+def distinct_values(conn, table_name, column):
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT DISTINCT [{column}] FROM {table_name} WHERE [{column}] IS NOT NULL ORDER BY [{column}]")
+    values = [row[0] for row in cursor.fetchall()]
+    cursor.close()
+    return values
+
+
+def count_rows(conn, table_name, year_month=None, property_id=None):
+    # Returns (matching_rows, total_rows) in one scan
+    clauses, params = _filter_clauses(year_month, property_id)
+    matching = f"SUM(CASE WHEN {' AND '.join(clauses)} THEN 1 ELSE 0 END)" if clauses else "COUNT(*)"
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT {matching}, COUNT(*) FROM {table_name}", *params)
+    matching_rows, total_rows = cursor.fetchone()
+    cursor.close()
+    return int(matching_rows or 0), int(total_rows or 0)
+
+
+def read_page(conn, table_name, year_month=None, property_id=None, after_key=None, page_size=PAGE_SIZE):
+    # Keyset pagination on (Year-Month, Property ID): after_key is the last key of the previous page
+    clauses, params = _filter_clauses(year_month, property_id)
+    if after_key is not None:
+        clauses.append("([Year-Month] > ? OR ([Year-Month] = ? AND [Property ID] > ?))")
+        params += [str(after_key[0]), str(after_key[0]), int(after_key[1])]
+    query = f"""
+        SELECT TOP ({int(page_size)}) *
+        FROM {table_name}
+        {_where(clauses)}
+        ORDER BY [Year-Month], [Property ID]
+    """
+    return apply_compact_dtypes(pd.read_sql(query, conn, params=params))
+
+
+def read_chunks(conn, table_name, year_month=None, property_id=None, chunk_size=10000):
+    # Stream the filtered rows as DataFrame chunks straight from the cursor
+    clauses, params = _filter_clauses(year_month, property_id)
+    query = f"SELECT * FROM {table_name} {_where(clauses)} ORDER BY [Year-Month], [Property ID]"
+    return pd.read_sql(query, conn, params=params, chunksize=chunk_size)
+
+
+def max_watermark(conn, table_name):
+    # None when the table has no watermark column yet
+    cursor = conn.cursor()
+    cursor.execute(f"""
+        IF COL_LENGTH('{table_name}', '{WATERMARK_COLUMN}') IS NOT NULL
+            EXEC('SELECT MAX([{WATERMARK_COLUMN}]) FROM {table_name}')
+        ELSE
+            SELECT CAST(NULL AS DATETIME2)
+    """)
+    value = cursor.fetchone()[0]
+    cursor.close()
+    return value
+
+
+def months_changed_since(conn, table_name, watermark):
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT DISTINCT [Year-Month] FROM {table_name} WHERE [{WATERMARK_COLUMN}] > ?", watermark)
+    months = [row[0] for row in cursor.fetchall()]
+    cursor.close()
+    return months
+
+
+def month_fingerprints(conn, table_name):
+    # Row count and an order-independent checksum of all columns per Year-Month, catches changes
+    # that did not touch the watermark (e.g. an UPDATE run outside the app)
+    cursor = conn.cursor()
+    cursor.execute(f"""
+        SELECT [Year-Month], COUNT_BIG(*), CHECKSUM_AGG(BINARY_CHECKSUM({_column_list()}))
+        FROM {table_name}
+        WHERE [Year-Month] IS NOT NULL
+        GROUP BY [Year-Month]
+    """)
+    fingerprints = {row[0]: [int(row[1]), int(row[2] or 0)] for row in cursor.fetchall()}
+    cursor.close()
+    return fingerprints
+
+
+def append_audit(conn, table_name, records):
+    # Insert-only; the caller commits
+    rows = records[[name for name, _ in AUDIT_COLUMNS]]
+    rows = list(rows.astype(object).where(rows.notna(), None).itertuples(index=False, name=None))
+    if not rows:
+        return
+    cursor = conn.cursor()
+    cursor.fast_executemany = True
+    column_list = ", ".join(f"[{name}]" for name, _ in AUDIT_COLUMNS)
+    insert_sql = f"INSERT INTO {audit_table_name(table_name)} ({column_list}) VALUES ({', '.join('?' for _ in AUDIT_COLUMNS)})"
+    for start in range(0, len(rows), INSERT_BATCH_SIZE):
+        cursor.executemany(insert_sql, rows[start:start + INSERT_BATCH_SIZE])
+    cursor.close()
+
+
+def read_audit(conn, table_name, year_month=None, property_id=None, limit=AUDIT_HISTORY_LIMIT):
+    # Newest changes first; nothing is recorded before the first Save created the audit table
+    if not _table_exists(conn, audit_table_name(table_name)):
+        return pd.DataFrame(columns=[name for name, _ in AUDIT_COLUMNS])
+    clauses, params = _filter_clauses(year_month, property_id)
+    return pd.read_sql(f"""
+        SELECT TOP ({int(limit)}) *
+        FROM {audit_table_name(table_name)}
+        {_where(clauses)}
+        ORDER BY [Changed At] DESC, [Field]
+    """, conn, params=params)
+
+
+def last_key(page):
+    # Key to pass as after_key for the page following this one
+    if page.empty:
+        return None
+    last = page.iloc[-1]
+    return str(last["Year-Month"]), int(last["Property ID"])
+
+
+def prepare_rows(frame, current_user):
+    # Coerce the edited grid to the table schema in one pass instead of per-row casts
+    rows = frame.reindex(columns=[name for name, _ in TABLE_COLUMNS]).copy()
+    rows["Year-Month"] = rows["Year-Month"].astype(str)
+    rows["Property ID"] = pd.to_numeric(rows["Property ID"]).astype("int64")
+    rows["Unit Count"] = pd.to_numeric(rows["Unit Count"]).astype("Int64")
+    rows["Occupancy Rate"] = pd.to_numeric(rows["Occupancy Rate"]).astype(float)
+    rows["Total Rent"] = pd.to_numeric(rows["Total Rent"]).astype(float)
+    rows["Edited"] = rows["Edited"].fillna(False).astype(bool)
+    # The version the row had when it was loaded, missing for rows added in the grid
+    rows[VERSION_COLUMN] = pd.to_numeric(rows[VERSION_COLUMN]).astype("Int64")
+    rows["Last Modified By"] = current_user
+    rows[WATERMARK_COLUMN] = None
+    # MERGE rejects several source rows for the same target row, keep the last edit per key
+    rows = rows.drop_duplicates(subset=KEY_COLUMNS, keep="last")
+    # pyodbc expects None for NULL, not NaN / pd.NA
+    rows = rows.astype(object).where(rows.notna(), None)
+    return list(rows.itertuples(index=False, name=None))
+
+
+def bulk_upsert(conn, table_name, frame, current_user, check_version=True):
+    # Load the rows into a session temp table and apply them with one set-based MERGE.
+    # Existing rows are only updated when marked as edited and still at the loaded version,
+    # new rows are always inserted. Edits of rows changed by someone else since they were
+    # loaded are skipped and returned as conflicts. Returns an UpsertResult once committed.
+    # check_version=False overwrites edited rows whatever their version (file imports).
+    rows = prepare_rows(frame, current_user)
+    if not rows:
+        empty = pd.DataFrame(columns=[name for name, _ in TABLE_COLUMNS])
+        return UpsertResult(0, 0, empty, empty)
+
+    # The session temp tables are created, loaded and dropped in autocommit mode; only the reads
+    # against the table and the writes to the rollup and the table run in the transaction
+    cursor = conn.cursor()
+    conn.autocommit = True
+    _create_temp_tables(cursor)
+    cursor.fast_executemany = True
+    placeholders = ", ".join("?" for _ in TABLE_COLUMNS)
+    insert_sql = f"INSERT INTO {STAGING_TABLE} ({_column_list()}) VALUES ({placeholders})"
+    for start in range(0, len(rows), INSERT_BATCH_SIZE):
+        cursor.executemany(insert_sql, rows[start:start + INSERT_BATCH_SIZE])
+    conn.autocommit = False
+    try:
+        result = _merge_staged_rows(conn, cursor, table_name, current_user, check_version)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    conn.autocommit = True
+    _drop_temp_tables(cursor)
+    conn.autocommit = False
+    cursor.close()
+    return result
+
+
+def _merge_staged_rows(conn, cursor, table_name, current_user, check_version):
+    # The transaction part of bulk_upsert, the staged rows are in STAGING_TABLE.
+    # The lock row is taken first and held until commit, everything below is read under it.
+    cursor.execute(f"UPDATE {lock_table_name(table_name)} SET [Locked At] = SYSUTCDATETIME(), [Locked By] = ?", current_user)
+    key_join = " AND ".join(f"t.[{name}] = s.[{name}]" for name in KEY_COLUMNS)
+    version_matches = _version_matches("t", "s") if check_version else "1 = 1"
+    # One set-based comparison finds every edit made against an outdated row
+    conflicts = pd.read_sql(f"""
+        SELECT {_column_list("t.")}
+        FROM {STAGING_TABLE} AS s
+        JOIN {table_name} AS t ON {key_join}
+        WHERE s.[Edited] = 1 AND NOT ({version_matches})
+    """, conn)
+    # The values the rows being written replace, for the audit trail
+    previous = pd.read_sql(f"""
+        SELECT {", ".join(f"s.[{name}]" if name in KEY_COLUMNS else f"t.[{name}]" for name, _ in TABLE_COLUMNS)}
+        FROM {STAGING_TABLE} AS s
+        LEFT JOIN {table_name} AS t ON {key_join}
+        WHERE t.[Property ID] IS NULL OR (s.[Edited] = 1 AND {version_matches})
+    """, conn)
+    cursor.execute(f"""
+        SELECT
+            SUM(CASE WHEN t.[Property ID] IS NOT NULL AND s.[Edited] = 1 AND {version_matches} THEN 1 ELSE 0 END),
+            SUM(CASE WHEN t.[Property ID] IS NULL THEN 1 ELSE 0 END)
+        FROM {STAGING_TABLE} AS s
+        LEFT JOIN {table_name} AS t ON {key_join}
+    """)
+    updates_count, inserts_count = cursor.fetchone()
+
+    _apply_rollup_deltas(cursor, table_name, key_join, version_matches)
+
+    update_columns = [name for name, _ in TABLE_COLUMNS if name not in KEY_COLUMNS]
+    # An updated row gets the version after the one it had in the table
+    update_set = ",\n                ".join(
+        f"t.[{name}] = {_merge_value(name, 't.' if name == VERSION_COLUMN else 's.')}" for name in update_columns)
+    cursor.execute(f"""
+        MERGE {table_name} AS t
+        USING {STAGING_TABLE} AS s
+        ON {key_join}
+        WHEN MATCHED AND s.[Edited] = 1 AND {version_matches} THEN
+            UPDATE SET
+                {update_set}
+        WHEN NOT MATCHED BY TARGET THEN
+            INSERT ({_column_list()})
+            VALUES ({", ".join(_merge_value(name, "s.") for name, _ in TABLE_COLUMNS)});
+    """)
+    return UpsertResult(int(updates_count or 0), int(inserts_count or 0), conflicts, previous)
@@ -0,0 +1,117 @@
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+import pandas as pd
+
+
+def _estimate_size(value):
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(sys.getsizeof(item) for item in value)
+    return sys.getsizeof(value)
+
+
+class QueryCache:
+    """Process-wide TTL + LRU cache for query results, bounded by approximate memory use.
+
+    Cached values are shared between sessions and must be treated as read-only.
+    """
+
+    def __init__(self, ttl_seconds=None, max_bytes=None):
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else float(os.getenv("QUERY_CACHE_TTL", "300"))
+        self.max_bytes = max_bytes if max_bytes is not None else int(float(os.getenv("QUERY_CACHE_MAX_MB", "256")) * 1024 * 1024)
+        # key -> (value, expires_at, size, table_name, year_month)
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _drop(self, key):
+        entry = self._entries.pop(key)
+        self._bytes -= entry[2]
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return True, entry[0]
+            if entry is not None:
+                self._drop(key)
+            self.misses += 1
+            return False, None
+
+    def put(self, key, value, table_name, year_month=None):
+        # year_month=None marks a result that spans all months
+        size = _estimate_size(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (value, time.monotonic() + self.ttl_seconds, size, table_name, year_month)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def get_or_load(self, key, loader, table_name, year_month=None):
+        found, value = self.get(key)
+        if found:
+            return value
+        # Loading happens outside the lock; concurrent misses may both load, the last one wins
+        value = loader()
+        self.put(key, value, table_name, year_month)
+        return value
+
+    def invalidate(self, table_name, months=None):
+        # Drop the results for the given months plus every result that spans all months;
+        # months=None drops everything cached for the table
+        months = None if months is None else {str(month) for month in months}
+        with self._lock:
+            stale = [
+                key for key, entry in self._entries.items()
+                if entry[3] == table_name and (months is None or entry[4] is None or entry[4] in months)
+            ]
+            for key in stale:
+                self._drop(key)
+            self.invalidations += len(stale)
+        return len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_query_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = QueryCache()
+        return _cache
@@ -0,0 +1,230 @@
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from audit_log import get_audit_writer
+from importers import IMPORT_CHUNK_SIZE, upload_chunks
+from perf_metrics import span
+from property_store import KEY_COLUMNS, VERSION_COLUMN
+from validation import errors, validate_frame
+
+SAVE_BATCH_SIZE = int(os.getenv("SAVE_BATCH_SIZE", "2000"))
+# Finished jobs are kept this long so the session that started them can read the summary
+JOB_RETENTION_SECONDS = 3600
+# Validation problems kept per import for the report, the counts cover all of them
+MAX_REJECTED_REPORTED = 10000
+
+
+class SaveJob:
+    """A Save or file import running in the background, written and committed in batches.
+
+    total_rows is None for imports, whose size is only known once the file has been read;
+    their progress is the share of the file read so far.
+    """
+
+    def __init__(self, table_name, total_rows, user, role=None, kind="save"):
+        self.id = uuid.uuid4().hex
+        self.table_name = table_name
+        self.user = user
+        self.role = role
+        self.kind = kind
+        self.total_rows = total_rows
+        self.state = "queued"
+        self.rows_done = 0
+        self.rows_read = 0
+        self.rows_rejected = 0
+        self.source_progress = 0.0
+        self._rejected = []
+        self._batch_stats = []
+        self.updates_count = 0
+        self.inserts_count = 0
+        self.batches_committed = 0
+        self.conflicts_count = 0
+        self._conflicts = []
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._cancel = threading.Event()
+        self._lock = threading.Lock()
+
+    def cancel(self):
+        # Stops after the batch in progress; batches already committed stay committed
+        self._cancel.set()
+
+    @property
+    def cancel_requested(self):
+        return self._cancel.is_set()
+
+    @property
+    def finished(self):
+        return self.state in ("done", "failed", "cancelled")
+
+    def status(self):
+        with self._lock:
+            if self.total_rows is None:
+                progress = 1.0 if self.state == "done" else self.source_progress
+            else:
+                progress = self.rows_done / self.total_rows if self.total_rows else 1.0
+            seconds = ((self.finished_at or time.time()) - self.started_at) if self.started_at else 0.0
+            return {
+                "id": self.id,
+                "kind": self.kind,
+                "state": self.state,
+                "total_rows": self.total_rows,
+                "rows_done": self.rows_done,
+                "rows_read": self.rows_read,
+                "rows_rejected": self.rows_rejected,
+                "progress": progress,
+                "seconds": seconds,
+                "rows_per_second": self.rows_done / seconds if seconds else 0.0,
+                "batch_stats": list(self._batch_stats),
+                "updates_count": self.updates_count,
+                "inserts_count": self.inserts_count,
+                "batches_committed": self.batches_committed,
+                "conflicts_count": self.conflicts_count,
+                "error": self.error,
+            }
+
+    def conflicts(self):
+        # (mine, theirs): the user's edits that were not saved, rebased on the current Row Version,
+        # and the current table rows they conflict with
+        with self._lock:
+            pairs = list(self._conflicts)
+        if not pairs:
+            return None, None
+        return pd.concat([mine for mine, _ in pairs], ignore_index=True), pd.concat([theirs for _, theirs in pairs], ignore_index=True)
+
+    def rejected(self):
+        # Validation errors of the rows an import left out, at most MAX_REJECTED_REPORTED
+        with self._lock:
+            if not self._rejected:
+                return None
+            return pd.concat(self._rejected, ignore_index=True)
+
+    def _add_rejected(self, rows_read, row_errors):
+        with self._lock:
+            self.rows_read += rows_read
+            self.rows_rejected += row_errors["row"].nunique()
+            room = MAX_REJECTED_REPORTED - sum(len(rejected) for rejected in self._rejected)
+            if room > 0 and len(row_errors):
+                self._rejected.append(row_errors.iloc[:room])
+
+    def _add_batch(self, rows, seconds):
+        with self._lock:
+            self._batch_stats.append({
+                "batch": len(self._batch_stats) + 1,
+                "rows": rows,
+                "seconds": seconds,
+                "rows_per_second": rows / seconds if seconds else 0.0,
+            })
+
+    def _add_conflicts(self, batch, current):
+        keys = current[KEY_COLUMNS].astype({"Year-Month": str, "Property ID": "int64"})
+        mine = batch.astype({"Year-Month": str, "Property ID": "int64"}).drop(columns=[VERSION_COLUMN], errors="ignore")
+        mine = mine.drop_duplicates(subset=KEY_COLUMNS, keep="last").merge(
+            keys.assign(**{VERSION_COLUMN: current[VERSION_COLUMN].to_numpy()}), on=KEY_COLUMNS)
+        with self._lock:
+            self._conflicts.append((mine, current))
+            self.conflicts_count += len(mine)
+
+    def _update(self, **values):
+        with self._lock:
+            for name, value in values.items():
+                setattr(self, name, value)
+
+
+def _batches(frame, batch_size):
+    for start in range(0, len(frame), batch_size):
+        yield frame.iloc[start:start + batch_size]
+
+
+def _import_batches(job, chunks):
+    # Every chunk is validated and coerced on its own, so memory stays at one chunk.
+    # Rows with errors are left out and reported, the other rows of the chunk are written.
+    for chunk, fraction in chunks:
+        with span("import.validate", rows=len(chunk), job=job.id) as timing:
+            validation = validate_frame(chunk)
+            row_errors = errors(validation.violations)
+            timing["rejected"] = len(row_errors)
+        job._add_rejected(len(chunk), row_errors)
+        job._update(source_progress=fraction)
+        yield validation.frame.drop(index=row_errors["row"].unique()).assign(Edited=True)
+
+
+def _run(job, backend, batches, on_commit, check_version=True):
+    job._update(state="running", started_at=time.time())
+    try:
+        backend.ensure_table()
+        audit = get_audit_writer(backend)
+        # A batch's time covers producing it (e.g. parsing and validating an import chunk) and writing it
+        started = time.perf_counter()
+        for batch in batches:
+            if job.cancel_requested:
+                job._update(state="cancelled")
+                break
+            # Every batch is written and committed in its own transaction
+            with span(f"{job.kind}.batch", rows=len(batch), job=job.id, backend=backend.name):
+                result = backend.bulk_upsert(batch, job.user, check_version)
+            # The audit trail is written in the background, the save does not wait for it
+            audit.record(result.previous, batch, job.user, job.role, job.id)
+            if len(result.conflicts):
+                job._add_conflicts(batch, result.conflicts)
+            job._update(
+                rows_done=job.rows_done + len(batch),
+                updates_count=job.updates_count + result.updates_count,
+                inserts_count=job.inserts_count + result.inserts_count,
+                batches_committed=job.batches_committed + 1,
+            )
+            if on_commit is not None:
+                on_commit(batch)
+            job._add_batch(len(batch), time.perf_counter() - started)
+            started = time.perf_counter()
+        else:
+            job._update(state="done")
+    except Exception as e:
+        job._update(state="failed", error=str(e))
+    finally:
+        job._update(finished_at=time.time())
+
+
+_executor = None
+_jobs = {}
+_jobs_lock = threading.Lock()
+
+
+def _submit(job, backend, batches, on_commit, check_version=True):
+    global _executor
+    with _jobs_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=int(os.getenv("SAVE_WORKERS", "2")), thread_name_prefix="save-job")
+        now = time.time()
+        for job_id in [job_id for job_id, old in _jobs.items() if old.finished_at and now - old.finished_at > JOB_RETENTION_SECONDS]:
+            del _jobs[job_id]
+        _jobs[job.id] = job
+    _executor.submit(_run, job, backend, batches, on_commit, check_version)
+    return job
+
+
+def submit_save_job(backend, frame, user, batch_size=SAVE_BATCH_SIZE, on_commit=None, role=None):
+    # on_commit(batch) runs on the worker thread after every committed batch
+    job = SaveJob(backend.table_name, len(frame), user, role)
+    return _submit(job, backend, _batches(frame, batch_size), on_commit)
+
+
+def submit_import_job(backend, file, filename, user, chunk_size=IMPORT_CHUNK_SIZE, on_commit=None, role=None):
+    # Stream a CSV or XLSX file into the table chunk by chunk. The file is the source of truth,
+    # so its rows overwrite existing ones without a version check. Raises InvalidImportFile
+    # for unsupported files; problems inside the file fail the job or reject rows.
+    chunks = upload_chunks(file, filename, chunk_size)
+    job = SaveJob(backend.table_name, None, user, role, kind="import")
+    return _submit(job, backend, _import_batches(job, chunks), on_commit, check_version=False)
+
+
+def get_save_job(job_id):
+    with _jobs_lock:
+        return _jobs.get(job_id)
@@ -0,0 +1,216 @@
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from datetime import datetime
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from frame_schema import apply_compact_dtypes
+from property_store import KEY_COLUMNS, PAGE_SIZE, TABLE_COLUMNS
+
+ARROW_TYPES = {
+    "NVARCHAR": pa.string(),
+    "INT": pa.int64(),
+    "FLOAT": pa.float64(),
+    "BIT": pa.bool_(),
+    "DATETIME2": pa.timestamp("us"),
+}
+SNAPSHOT_SCHEMA = pa.schema([(name, ARROW_TYPES[sql_type.split("(")[0]]) for name, sql_type in TABLE_COLUMNS])
+# Rows stamped after this count as changed when the last sync had no watermark
+EPOCH = datetime(1900, 1, 1)
+# A synced snapshot is trusted this long before the database is asked for changes again
+SYNC_INTERVAL_SECONDS = float(os.getenv("SNAPSHOT_SYNC_SECONDS", "60"))
+# Every partition is re-fetched this often, in case a change slipped past the watermark and the fingerprints
+FULL_REFRESH_SECONDS = float(os.getenv("SNAPSHOT_FULL_REFRESH_SECONDS", "86400"))
+
+
+class SnapshotCache:
+    """On-disk Parquet copy of a table, one file per Year-Month, refreshed by watermark and month fingerprints.
+
+    Partitions are replaced atomically, so readers never see half-written files.
+    """
+
+    def __init__(self, root, table_name, full_refresh_seconds=FULL_REFRESH_SECONDS):
+        self.table_name = table_name
+        self.full_refresh_seconds = full_refresh_seconds
+        self.directory = os.path.join(root, re.sub(r"[^A-Za-z0-9_.-]+", "_", table_name).strip("_"))
+        self.state_path = os.path.join(self.directory, "_state.json")
+        os.makedirs(self.directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._stale = False
+        self._synced_at = 0.0
+
+    def _partition_path(self, year_month):
+        return os.path.join(self.directory, f"{year_month}.parquet")
+
+    def _read_state(self):
+        if not os.path.exists(self.state_path):
+            return None
+        with open(self.state_path, encoding="utf-8") as f:
+            return json.load(f)
+
+    @staticmethod
+    def _tmp_path(path):
+        # Other processes may sync the same directory, every writer gets its own temp file
+        return f"{path}.{os.getpid()}.{uuid.uuid4().hex}.tmp"
+
+    def _write_state(self, state):
+        tmp_path = self._tmp_path(self.state_path)
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(state, f)
+            os.replace(tmp_path, self.state_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    @staticmethod
+    def _to_arrow(chunk):
+        # Coerce a fetched chunk to the snapshot schema; all-NULL columns come back as float NaN
+        arrays = []
+        for field in SNAPSHOT_SCHEMA:
+            values = chunk[field.name] if field.name in chunk.columns else pd.Series(None, index=chunk.index, dtype=object)
+            if pa.types.is_string(field.type):
+                values = values.astype(object).where(values.isna(), values.astype(str))
+            elif pa.types.is_timestamp(field.type):
+                values = pd.to_datetime(values)
+            elif pa.types.is_boolean(field.type):
+                # BIT arrives as bool from Synapse and as 0/1 from SQLite
+                values = values.astype("boolean")
+            else:
+                values = pd.to_numeric(values)
+            arrays.append(pa.array(values, type=field.type, from_pandas=True))
+        return pa.Table.from_arrays(arrays, schema=SNAPSHOT_SCHEMA)
+
+    def _fetch_partition(self, backend, year_month):
+        # Stream the month from the database into a new Parquet file, chunk by chunk
+        path = self._partition_path(year_month)
+        tmp_path = self._tmp_path(path)
+        try:
+            with pq.ParquetWriter(tmp_path, SNAPSHOT_SCHEMA) as writer:
+                for chunk in backend.read_chunks(year_month):
+                    writer.write_table(self._to_arrow(chunk))
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def sync(self, backend):
+        # Re-fetch only the months changed since the last sync; returns the refreshed months
+        state = self._read_state()
+        # Read the new watermark and fingerprints first, rows changed while fetching are picked up again
+        # next time. The watermark is None while no row has one yet (e.g. the column was just added)
+        watermark = backend.max_watermark()
+        fingerprints = {str(month): fingerprint for month, fingerprint in backend.month_fingerprints().items()}
+        months = sorted(fingerprints)
+        now = time.time()
+        # Partitions written before a schema change, or not fully refreshed for a while, are all re-fetched
+        full_refresh = (state is None or state.get("columns") != SNAPSHOT_SCHEMA.names
+                        or now - state.get("full_refresh_at", 0) >= self.full_refresh_seconds)
+        if full_refresh:
+            refresh = months
+        else:
+            # Writes from outside the app may not move the watermark, but they change the row count or checksum
+            previous = state.get("fingerprints", {})
+            changed = {month for month in months if previous.get(month) != fingerprints[month]}
+            if watermark is not None:
+                # Without a previous watermark every stamped row is newer than the snapshot
+                since = EPOCH if state.get("watermark") is None else pd.Timestamp(state["watermark"]).to_pydatetime()
+                changed |= {str(month) for month in backend.months_changed_since(since)}
+            refresh = sorted(changed)
+        for year_month in refresh:
+            self._fetch_partition(backend, year_month)
+        for year_month in set(state.get("months", []) if state else []) - set(months):
+            if os.path.exists(self._partition_path(year_month)):
+                os.remove(self._partition_path(year_month))
+        self._write_state({
+            "watermark": None if watermark is None else pd.Timestamp(watermark).isoformat(),
+            "months": months,
+            "fingerprints": fingerprints,
+            "columns": SNAPSHOT_SCHEMA.names,
+            "synced_at": now,
+            "full_refresh_at": now if full_refresh else state["full_refresh_at"],
+        })
+        return refresh
+
+    def sync_if_due(self, backend, max_age=SYNC_INTERVAL_SECONDS):
+        # Sync at most once per max_age per process, or right away after mark_stale()
+        with self._lock:
+            if not self._stale and time.monotonic() - self._synced_at < max_age:
+                return []
+            refreshed = self.sync(backend)
+            self._stale = False
+            self._synced_at = time.monotonic()
+            return refreshed
+
+    def mark_stale(self):
+        self._stale = True
+
+    def _months(self):
+        state = self._read_state()
+        return state["months"] if state else []
+
+    def _read(self, year_month=None, property_id=None):
+        # Partitions are memory-mapped, only the selected months are touched
+        months = self._months() if year_month is None else [str(year_month)]
+        tables = [
+            pq.read_table(self._partition_path(month), memory_map=True)
+            for month in months if os.path.exists(self._partition_path(month))
+        ]
+        table = pa.concat_tables(tables) if tables else SNAPSHOT_SCHEMA.empty_table()
+        if property_id is not None:
+            table = table.filter(pc.equal(table["Property ID"], int(property_id)))
+        return table
+
+    def distinct_values(self, column):
+        if column == "Year-Month":
+            return sorted(self._months())
+        return sorted(pc.unique(self._read().column(column).drop_null()).to_pylist())
+
+    def count_rows(self, year_month=None, property_id=None):
+        # Returns (matching_rows, total_rows) like property_store.count_rows
+        total_rows = sum(
+            pq.ParquetFile(self._partition_path(month)).metadata.num_rows
+            for month in self._months() if os.path.exists(self._partition_path(month))
+        )
+        if year_month is None and property_id is None:
+            return total_rows, total_rows
+        return self._read(year_month, property_id).num_rows, total_rows
+
+    def read_frame(self, year_month=None, property_id=None):
+        return apply_compact_dtypes(self._read(year_month, property_id).to_pandas())
+
+    def read_page(self, year_month=None, property_id=None, after_key=None, page_size=PAGE_SIZE):
+        # Same keyset pagination as property_store.read_page, served from the snapshot
+        table = self._read(year_month, property_id)
+        if after_key is not None:
+            after = pc.or_(
+                pc.greater(table["Year-Month"], str(after_key[0])),
+                pc.and_(pc.equal(table["Year-Month"], str(after_key[0])),
+                        pc.greater(table["Property ID"], int(after_key[1]))),
+            )
+            table = table.filter(after)
+        table = table.sort_by([(column, "ascending") for column in KEY_COLUMNS]).slice(0, page_size)
+        return apply_compact_dtypes(table.to_pandas())
+
+
+_snapshots = {}
+_snapshots_lock = threading.Lock()
+
+
+def get_snapshot_cache(table_name, backend_name="synapse"):
+    # One snapshot per backend, table and process; None when SNAPSHOT_DIR is set to an empty value
+    root = os.getenv("SNAPSHOT_DIR", ".snapshot_cache")
+    if not root:
+        return None
+    key = (backend_name, table_name)
+    with _snapshots_lock:
+        if key not in _snapshots:
+            _snapshots[key] = SnapshotCache(os.path.join(root, backend_name), table_name)
+        return _snapshots[key]
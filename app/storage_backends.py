@@ -0,0 +1,488 @@
+import os
+import sqlite3
+import threading
+import zlib
+from contextlib import contextmanager
+
+import pandas as pd
+
+import property_store
+from frame_schema import apply_compact_dtypes
+from property_store import (
+    AUDIT_COLUMNS, AUDIT_HISTORY_LIMIT, KEY_COLUMNS, PAGE_SIZE, ROLLUP_COLUMNS, ROLLUP_READ_COLUMNS, TABLE_COLUMNS,
+    VERSION_COLUMN, WATERMARK_COLUMN, UpsertResult, prepare_rows,
+)
+
+READ_CHUNK_SIZE = 10000
+
+
+class StorageBackend:
+    """Where the PropertyExport table lives. The app, the batch exporter and the snapshot only use these methods.
+
+    Filters are year_month / property_id, None meaning "All". Reads return DataFrames with the
+    compact dtypes of frame_schema; bulk_upsert writes a whole frame in one transaction.
+    """
+
+    name = None
+    table_name = None
+
+    @property
+    def configured(self):
+        # False when the connection settings are missing, the app then shows sample data
+        return True
+
+    def table_exists(self):
+        raise NotImplementedError
+
+    def ensure_table(self):
+        raise NotImplementedError
+
+    def distinct_values(self, column):
+        raise NotImplementedError
+
+    def count_rows(self, year_month=None, property_id=None):
+        # Returns (matching_rows, total_rows)
+        raise NotImplementedError
+
+    def read_page(self, year_month=None, property_id=None, after_key=None, page_size=PAGE_SIZE):
+        # Keyset pagination on (Year-Month, Property ID), after_key is the last key of the previous page
+        raise NotImplementedError
+
+    def read_chunks(self, year_month=None, property_id=None, chunk_size=READ_CHUNK_SIZE):
+        raise NotImplementedError
+
+    def read_frame(self, year_month=None, property_id=None):
+        chunks = list(self.read_chunks(year_month, property_id))
+        frame = pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame(columns=[name for name, _ in TABLE_COLUMNS])
+        return apply_compact_dtypes(frame)
+
+    def bulk_upsert(self, frame, user, check_version=True):
+        # Insert new rows, update existing rows marked as edited that are still at the loaded
+        # Row Version (any version when check_version is False), and commit; returns an
+        # UpsertResult with the conflicting table rows and the previous values of the written rows
+        raise NotImplementedError
+
+    def append_audit(self, records):
+        # Append audit records (AUDIT_COLUMNS) in one transaction; the audit table is never updated
+        raise NotImplementedError
+
+    def read_audit(self, year_month=None, property_id=None, limit=AUDIT_HISTORY_LIMIT):
+        # Field-level history, newest first
+        raise NotImplementedError
+
+    def read_rollup(self):
+        # Monthly totals (Property Count, Total Rent, Average Occupancy Rate, Unit Count) per Year-Month
+        raise NotImplementedError
+
+    def rebuild_rollup(self):
+        # Recompute the monthly totals from the table, e.g. after it was loaded outside the app
+        raise NotImplementedError
+
+    def max_watermark(self):
+        raise NotImplementedError
+
+    def months_changed_since(self, watermark):
+        raise NotImplementedError
+
+    def month_fingerprints(self):
+        # {Year-Month: [row count, checksum]}; a month whose fingerprint moved has changed
+        raise NotImplementedError
+
+    def close(self):
+        # Release pooled connections, e.g. before starting worker processes
+        pass
+
+
+class SynapseBackend(StorageBackend):
+    """Azure Synapse through the pooled pyodbc connections; writes use fast_executemany + MERGE."""
+
+    name = "synapse"
+
+    def __init__(self, settings):
+        self.settings = settings
+        self.table_name = settings["table_name"]
+
+    @property
+    def configured(self):
+        return bool(self.settings["password"])
+
+    @property
+    def db(self):
+        return _connection_manager(self.settings)
+
+    def table_exists(self):
+        return self.db.table_exists(self.table_name)
+
+    def ensure_table(self):
+        # Create the table or add missing columns once per process
+        db = self.db
+        if db.schema_ready(self.table_name):
+            return
+        with db.connection() as conn:
+            conn.autocommit = True
+            cursor = conn.cursor()
+            property_store.ensure_table(cursor, self.table_name)
+            cursor.close()
+            conn.autocommit = False
+        db.mark_schema_ready(self.table_name)
+
+    def distinct_values(self, column):
+        with self.db.connection() as conn:
+            return property_store.distinct_values(conn, self.table_name, column)
+
+    def count_rows(self, year_month=None, property_id=None):
+        with self.db.connection() as conn:
+            return property_store.count_rows(conn, self.table_name, year_month, property_id)
+
+    def read_page(self, year_month=None, property_id=None, after_key=None, page_size=PAGE_SIZE):
+        with self.db.connection() as conn:
+            return property_store.read_page(conn, self.table_name, year_month, property_id, after_key, page_size)
+
+    def read_chunks(self, year_month=None, property_id=None, chunk_size=READ_CHUNK_SIZE):
+        # The connection is held until the last chunk has been read
+        with self.db.connection() as conn:
+            yield from property_store.read_chunks(conn, self.table_name, year_month, property_id, chunk_size)
+
+    def bulk_upsert(self, frame, user, check_version=True):
+        with self.db.connection() as conn:
+            return property_store.bulk_upsert(conn, self.table_name, frame, user, check_version)
+
+    def append_audit(self, records):
+        self.ensure_table()
+        with self.db.connection() as conn:
+            property_store.append_audit(conn, self.table_name, records)
+            conn.commit()
+
+    def read_audit(self, year_month=None, property_id=None, limit=AUDIT_HISTORY_LIMIT):
+        with self.db.connection() as conn:
+            return property_store.read_audit(conn, self.table_name, year_month, property_id, limit)
+
+    def read_rollup(self):
+        # Reads never create tables, the rollup is created and filled by ensure_table on the first Save
+        with self.db.connection() as conn:
+            return property_store.read_rollup(conn, self.table_name)
+
+    def rebuild_rollup(self):
+        self.ensure_table()
+        with self.db.connection() as conn:
+            cursor = conn.cursor()
+            property_store.rebuild_rollup(cursor, self.table_name)
+            cursor.close()
+            conn.commit()
+
+    def max_watermark(self):
+        with self.db.connection() as conn:
+            return property_store.max_watermark(conn, self.table_name)
+
+    def months_changed_since(self, watermark):
+        with self.db.connection() as conn:
+            return property_store.months_changed_since(conn, self.table_name, watermark)
+
+    def month_fingerprints(self):
+        with self.db.connection() as conn:
+            return property_store.month_fingerprints(conn, self.table_name)
+
+    def close(self):
+        self.db.close_all()
+
+
+def _connection_manager(settings):
+    # Imported lazily so the SQLite backend works without pyodbc installed
+    from db_connection import get_connection_manager
+    return get_connection_manager(settings)
+
+
+SQLITE_TYPES = {"NVARCHAR": "TEXT", "INT": "INTEGER", "BIGINT": "INTEGER", "FLOAT": "REAL", "BIT": "INTEGER", "DATETIME2": "TEXT"}
+SQLITE_NOW = "strftime('%Y-%m-%d %H:%M:%f', 'now')"
+
+
+class _RowChecksum:
+    # SQLite aggregate standing in for CHECKSUM_AGG(BINARY_CHECKSUM(...)): order-independent sum of row CRCs
+    def __init__(self):
+        self.total = 0
+
+    def step(self, *values):
+        self.total = (self.total + zlib.crc32(repr(values).encode())) % 2 ** 32
+
+    def finalize(self):
+        return self.total
+
+
+def _quote(name):
+    return f'"{name}"'
+
+
+class SQLiteBackend(StorageBackend):
+    """Local SQLite file with the same schema, for development and load tests without Synapse."""
+
+    name = "sqlite"
+
+    def __init__(self, path, table_name="PropertyExport"):
+        self.path = path
+        self.table_name = table_name
+        self.rollup_table = f"{table_name}Monthly"
+        self.audit_table = f"{table_name}Audit"
+        self._schema_ready = False
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def _connection(self):
+        # SQLite connections are cheap, each call gets its own so threads never share one
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def table_exists(self):
+        with self._connection() as conn:
+            row = conn.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name = ?", (self.table_name,)).fetchone()
+        return row[0] > 0
+
+    def ensure_table(self):
+        with self._lock:
+            if self._schema_ready:
+                return
+            # Rows inserted outside the app get a watermark from the column default
+            columns = ", ".join(
+                f"{_quote(name)} {SQLITE_TYPES[sql_type.split('(')[0]]}" + (f" DEFAULT ({SQLITE_NOW})" if name == WATERMARK_COLUMN else "")
+                for name, sql_type in TABLE_COLUMNS)
+            with self._connection() as conn:
+                conn.execute(f"CREATE TABLE IF NOT EXISTS {_quote(self.table_name)} ({columns})")
+                existing = {row[1] for row in conn.execute(f"PRAGMA table_info({_quote(self.table_name)})")}
+                for name, sql_type in TABLE_COLUMNS:
+                    if name not in existing:
+                        conn.execute(f"ALTER TABLE {_quote(self.table_name)} ADD COLUMN {_quote(name)} {SQLITE_TYPES[sql_type.split('(')[0]]}")
+                # ALTER TABLE cannot add a column with a non-constant default, older rows are stamped instead
+                conn.execute(f"UPDATE {_quote(self.table_name)} SET {_quote(WATERMARK_COLUMN)} = {SQLITE_NOW} WHERE {_quote(WATERMARK_COLUMN)} IS NULL")
+                # The upsert needs a unique key, it also serves the filters and the keyset pagination
+                conn.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS {_quote('ix_' + self.table_name + '_key')} "
+                             f"ON {_quote(self.table_name)} ({', '.join(_quote(name) for name in KEY_COLUMNS)})")
+                # The rollup is built from the table once, from then on bulk_upsert keeps it up to date
+                rollup_exists = conn.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name = ?", (self.rollup_table,)).fetchone()[0]
+                if not rollup_exists:
+                    rollup_columns = ", ".join(f"{_quote(name)} {SQLITE_TYPES[sql_type]}" for name, sql_type in ROLLUP_COLUMNS[1:])
+                    conn.execute(f'CREATE TABLE {_quote(self.rollup_table)} ("Year-Month" TEXT PRIMARY KEY, {rollup_columns})')
+                    self._rebuild_rollup(conn)
+                audit_columns = ", ".join(f"{_quote(name)} {SQLITE_TYPES[sql_type.split('(')[0]]}" for name, sql_type in AUDIT_COLUMNS)
+                conn.execute(f"CREATE TABLE IF NOT EXISTS {_quote(self.audit_table)} ({audit_columns})")
+                conn.execute(f"CREATE INDEX IF NOT EXISTS {_quote('ix_' + self.audit_table + '_property')} "
+                             f'ON {_quote(self.audit_table)} ("Property ID", "Year-Month", "Changed At")')
+                conn.commit()
+            self._schema_ready = True
+
+    @staticmethod
+    def _rollup_aggregates(prefix):
+        return [
+            f'IFNULL(SUM({prefix}"Total Rent"), 0)',
+            f'IFNULL(SUM({prefix}"Occupancy Rate"), 0)',
+            f'COUNT({prefix}"Occupancy Rate")',
+            f'IFNULL(SUM({prefix}"Unit Count"), 0)',
+        ]
+
+    def _rebuild_rollup(self, conn):
+        conn.execute(f"DELETE FROM {_quote(self.rollup_table)}")
+        conn.execute(f"""
+            INSERT INTO {_quote(self.rollup_table)} ({", ".join(_quote(name) for name, _ in ROLLUP_COLUMNS)})
+            SELECT "Year-Month", COUNT(*), {", ".join(self._rollup_aggregates(""))}, {SQLITE_NOW}
+            FROM {_quote(self.table_name)}
+            GROUP BY "Year-Month"
+        """)
+
+    def _has_table(self, conn, table_name):
+        return conn.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name = ?", (table_name,)).fetchone()[0] > 0
+
+    def read_rollup(self):
+        # Like the Synapse backend, reads never create tables
+        with self._connection() as conn:
+            if not self._has_table(conn, self.rollup_table):
+                return pd.DataFrame(columns=ROLLUP_READ_COLUMNS)
+            return pd.read_sql(f"""
+                SELECT "Year-Month", "Property Count", "Total Rent",
+                    "Occupancy Rate Sum" / NULLIF("Occupancy Rate Count", 0) AS "Average Occupancy Rate",
+                    "Unit Count"
+                FROM {_quote(self.rollup_table)}
+                ORDER BY "Year-Month"
+            """, conn)
+
+    def rebuild_rollup(self):
+        self.ensure_table()
+        with self._connection() as conn:
+            self._rebuild_rollup(conn)
+            conn.commit()
+
+    @staticmethod
+    def _filter_clauses(year_month=None, property_id=None):
+        clauses, params = [], []
+        if year_month is not None:
+            clauses.append('"Year-Month" = ?')
+            params.append(str(year_month))
+        if property_id is not None:
+            clauses.append('"Property ID" = ?')
+            params.append(int(property_id))
+        return clauses, params
+
+    def distinct_values(self, column):
+        with self._connection() as conn:
+            rows = conn.execute(f"SELECT DISTINCT {_quote(column)} FROM {_quote(self.table_name)} "
+                                f"WHERE {_quote(column)} IS NOT NULL ORDER BY {_quote(column)}").fetchall()
+        return [row[0] for row in rows]
+
+    def count_rows(self, year_month=None, property_id=None):
+        clauses, params = self._filter_clauses(year_month, property_id)
+        matching = f"SUM(CASE WHEN {' AND '.join(clauses)} THEN 1 ELSE 0 END)" if clauses else "COUNT(*)"
+        with self._connection() as conn:
+            matching_rows, total_rows = conn.execute(f"SELECT {matching}, COUNT(*) FROM {_quote(self.table_name)}", params).fetchone()
+        return int(matching_rows or 0), int(total_rows or 0)
+
+    def read_page(self, year_month=None, property_id=None, after_key=None, page_size=PAGE_SIZE):
+        clauses, params = self._filter_clauses(year_month, property_id)
+        if after_key is not None:
+            clauses.append('("Year-Month" > ? OR ("Year-Month" = ? AND "Property ID" > ?))')
+            params += [str(after_key[0]), str(after_key[0]), int(after_key[1])]
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        query = f'SELECT * FROM {_quote(self.table_name)} {where} ORDER BY "Year-Month", "Property ID" LIMIT ?'
+        with self._connection() as conn:
+            return apply_compact_dtypes(pd.read_sql(query, conn, params=params + [int(page_size)]))
+
+    def read_chunks(self, year_month=None, property_id=None, chunk_size=READ_CHUNK_SIZE):
+        clauses, params = self._filter_clauses(year_month, property_id)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        query = f'SELECT * FROM {_quote(self.table_name)} {where} ORDER BY "Year-Month", "Property ID"'
+        with self._connection() as conn:
+            yield from pd.read_sql(query, conn, params=params, chunksize=chunk_size)
+
+    def bulk_upsert(self, frame, user, check_version=True):
+        # Same semantics as the Synapse MERGE: staging table, one count query, one set-based upsert
+        rows = prepare_rows(frame, user)
+        columns = [name for name, _ in TABLE_COLUMNS]
+        if not rows:
+            return UpsertResult(0, 0, pd.DataFrame(columns=columns), pd.DataFrame(columns=columns))
+        self.ensure_table()
+        table = _quote(self.table_name)
+        version = _quote(VERSION_COLUMN)
+        column_list = ", ".join(_quote(name) for name in columns)
+        key_join = " AND ".join(f"t.{_quote(name)} = s.{_quote(name)}" for name in KEY_COLUMNS)
+        version_matches = f"IFNULL(t.{version}, 0) = IFNULL(s.{version}, 0)" if check_version else "1 = 1"
+        # Rows are proposed with the next version, an update only applies when the
+        # table row is still at the version before it
+        values = ", ".join(
+            SQLITE_NOW if name == WATERMARK_COLUMN else f"IFNULL(s.{version}, 0) + 1" if name == VERSION_COLUMN else f"s.{_quote(name)}"
+            for name in columns
+        )
+        version_guard = f" AND IFNULL({table}.{version}, 0) + 1 = excluded.{version}" if check_version else ""
+        updates = ", ".join(
+            f"{_quote(name)} = " + (SQLITE_NOW if name == WATERMARK_COLUMN else f"IFNULL({version}, 0) + 1" if name == VERSION_COLUMN else "excluded." + _quote(name))
+            for name in columns if name not in KEY_COLUMNS
+        )
+        with self._connection() as conn:
+            # Take the write lock before the first read; a read transaction that later upgrades to a
+            # write fails right away when another writer (a second save, the audit writer) is active
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(f"CREATE TEMP TABLE staging AS SELECT * FROM main.{table} WHERE 0")
+            conn.executemany(f"INSERT INTO staging ({column_list}) VALUES ({', '.join('?' for _ in columns)})", rows)
+            conflicts = pd.read_sql(f"""
+                SELECT {", ".join(f"t.{_quote(name)}" for name in columns)}
+                FROM staging AS s JOIN {table} AS t ON {key_join}
+                WHERE s."Edited" = 1 AND NOT ({version_matches})
+            """, conn)
+            previous = pd.read_sql(f"""
+                SELECT {", ".join(f"{'s' if name in KEY_COLUMNS else 't'}.{_quote(name)}" for name in columns)}
+                FROM staging AS s LEFT JOIN {table} AS t ON {key_join}
+                WHERE t."Property ID" IS NULL OR (s."Edited" = 1 AND {version_matches})
+            """, conn)
+            updates_count, inserts_count = conn.execute(f"""
+                SELECT
+                    SUM(CASE WHEN t."Property ID" IS NOT NULL AND s."Edited" = 1 AND {version_matches} THEN 1 ELSE 0 END),
+                    SUM(CASE WHEN t."Property ID" IS NULL THEN 1 ELSE 0 END)
+                FROM staging AS s LEFT JOIN {table} AS t ON {key_join}
+            """).fetchone()
+            # Monthly totals move by the new values minus the values they replace, before the upsert
+            rollup_values = [name for name, _ in ROLLUP_COLUMNS if name not in ("Year-Month", "Updated At")]
+            deltas = [f"{new} - {old}" for new, old in zip(self._rollup_aggregates("s."), self._rollup_aggregates("t."))]
+            conn.execute(f"""
+                INSERT INTO {_quote(self.rollup_table)} ({", ".join(_quote(name) for name, _ in ROLLUP_COLUMNS)})
+                SELECT s."Year-Month", SUM(CASE WHEN t."Property ID" IS NULL THEN 1 ELSE 0 END), {", ".join(deltas)}, {SQLITE_NOW}
+                FROM staging AS s LEFT JOIN {table} AS t ON {key_join}
+                WHERE t."Property ID" IS NULL OR (s."Edited" = 1 AND {version_matches})
+                GROUP BY s."Year-Month"
+                ON CONFLICT ("Year-Month") DO UPDATE SET
+                    {", ".join(f"{_quote(name)} = {_quote(name)} + excluded.{_quote(name)}" for name in rollup_values)},
+                    "Updated At" = excluded."Updated At"
+            """)
+            conn.execute(f"""
+                INSERT INTO {table} ({column_list})
+                SELECT {values} FROM staging AS s WHERE true
+                ON CONFLICT ({', '.join(_quote(name) for name in KEY_COLUMNS)}) DO UPDATE SET {updates}
+                WHERE excluded."Edited" = 1{version_guard}
+            """)
+            conn.commit()
+        return UpsertResult(int(updates_count or 0), int(inserts_count or 0), conflicts, previous)
+
+    def append_audit(self, records):
+        rows = records[[name for name, _ in AUDIT_COLUMNS]]
+        # Timestamps are stored as text, in the same format as the watermark
+        rows = rows.assign(**{"Changed At": pd.to_datetime(rows["Changed At"]).dt.strftime("%Y-%m-%d %H:%M:%S.%f").str[:-3]})
+        rows = list(rows.astype(object).where(rows.notna(), None).itertuples(index=False, name=None))
+        if not rows:
+            return
+        self.ensure_table()
+        with self._connection() as conn:
+            conn.executemany(f"INSERT INTO {_quote(self.audit_table)} ({', '.join(_quote(name) for name, _ in AUDIT_COLUMNS)}) "
+                             f"VALUES ({', '.join('?' for _ in AUDIT_COLUMNS)})", rows)
+            conn.commit()
+
+    def read_audit(self, year_month=None, property_id=None, limit=AUDIT_HISTORY_LIMIT):
+        clauses, params = self._filter_clauses(year_month, property_id)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        query = f'SELECT * FROM {_quote(self.audit_table)} {where} ORDER BY "Changed At" DESC, "Field" LIMIT ?'
+        with self._connection() as conn:
+            if not self._has_table(conn, self.audit_table):
+                return pd.DataFrame(columns=[name for name, _ in AUDIT_COLUMNS])
+            history = pd.read_sql(query, conn, params=params + [int(limit)])
+        history["Changed At"] = pd.to_datetime(history["Changed At"])
+        return history
+
+    def max_watermark(self):
+        with self._connection() as conn:
+            value = conn.execute(f"SELECT MAX({_quote(WATERMARK_COLUMN)}) FROM {_quote(self.table_name)}").fetchone()[0]
+        return None if value is None else pd.Timestamp(value).to_pydatetime()
+
+    def months_changed_since(self, watermark):
+        # Watermarks are stored as text in SQLite, compare in the same format
+        stamp = pd.Timestamp(watermark).strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
+        with self._connection() as conn:
+            rows = conn.execute(f'SELECT DISTINCT "Year-Month" FROM {_quote(self.table_name)} WHERE {_quote(WATERMARK_COLUMN)} > ?', (stamp,)).fetchall()
+        return [row[0] for row in rows]
+
+    def month_fingerprints(self):
+        columns = ", ".join(_quote(name) for name, _ in TABLE_COLUMNS)
+        with self._connection() as conn:
+            conn.create_aggregate("row_checksum", -1, _RowChecksum)
+            rows = conn.execute(f'SELECT "Year-Month", COUNT(*), row_checksum({columns}) FROM {_quote(self.table_name)} '
+                                f'WHERE "Year-Month" IS NOT NULL GROUP BY "Year-Month"').fetchall()
+        return {row[0]: [int(row[1]), int(row[2])] for row in rows}
+
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+def get_storage_backend(settings=None):
+    # STORAGE_BACKEND selects the backend: "synapse" (default) or "sqlite" (SQLITE_PATH, SQLITE_TABLE)
+    from dotenv import load_dotenv
+    load_dotenv()
+    kind = os.getenv("STORAGE_BACKEND", "synapse").lower()
+    if kind == "sqlite":
+        key = (kind, os.getenv("SQLITE_PATH", "property_export.db"), os.getenv("SQLITE_TABLE", "PropertyExport"))
+    elif kind == "synapse":
+        if settings is None:
+            from db_connection import load_synapse_settings
+            settings = load_synapse_settings()
+        key = (kind,) + tuple(sorted(settings.items()))
+    else:
+        raise ValueError(f"Unknown STORAGE_BACKEND {kind!r}, expected 'synapse' or 'sqlite'")
+    with _backends_lock:
+        if key not in _backends:
+            _backends[key] = SQLiteBackend(key[1], key[2]) if kind == "sqlite" else SynapseBackend(settings)
+        return _backends[key]
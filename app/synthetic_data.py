@@ -0,0 +1,45 @@
+import numpy as np
+import pandas as pd
+
+# Synthetic PropertyExport data that extends the sample rows of main_app (April/May 2025,
+# Property IDs from 1001) to any number of months and properties, for load tests and benchmarks.
+
+
+def month_range(count, first="2025-04"):
+    return [str(period) for period in pd.period_range(first, periods=count, freq="M")]
+
+
+def generate_property_data(rows, months=None, seed=0, user="admin"):
+    # Spread `rows` over `months` months (default: as many as needed for 10 000 properties),
+    # one row per (Year-Month, Property ID)
+    rng = np.random.default_rng(seed)
+    if months is None:
+        months = max(1, -(-rows // 10000))
+    properties = -(-rows // months)
+    month_values = np.array(month_range(months))
+
+    month_index = np.arange(rows) // properties
+    property_index = np.arange(rows) % properties
+    property_names = pd.Series(property_index + 1).astype(str)
+
+    return pd.DataFrame({
+        "Year-Month": month_values[month_index],
+        "Property ID": 1001 + property_index,
+        "Property Name": ("Newsec Sweden HQ " + property_names).to_numpy(),
+        "Unit Count": 50 + property_index % 50 + month_index % 3,
+        "Occupancy Rate": np.round(rng.uniform(0.7, 1.0, rows), 2),
+        "Total Rent": np.round(120000.0 + 1000 * (property_index % 100) + rng.normal(0, 2500, rows), 2),
+        "Comment": ("Data for unit " + property_names).to_numpy(),
+        "Last Modified By": user,
+        "Edited": False,
+    })
+
+
+def edit_rows(frame, count, seed=1):
+    # Copy of the frame with `count` random rows changed the way a user would in the grid
+    rng = np.random.default_rng(seed)
+    edited = frame.copy()
+    positions = rng.choice(len(frame), size=min(count, len(frame)), replace=False)
+    edited.iloc[positions, edited.columns.get_loc("Total Rent")] += 100.0
+    edited.iloc[positions, edited.columns.get_loc("Comment")] = "Corrected"
+    return edited
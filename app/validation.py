@@ -0,0 +1,182 @@
+import os
+import re
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from property_store import KEY_COLUMNS, TABLE_COLUMNS
+
+# Rules applied to the whole frame at once before anything is written. Errors block the Save,
+# warnings (month-over-month anomalies) are shown for confirmation.
+REQUIRED_COLUMNS = ["Year-Month", "Property ID", "Property Name"]
+INTEGER_COLUMNS = ["Property ID", "Unit Count"]
+NUMERIC_COLUMNS = INTEGER_COLUMNS + ["Occupancy Rate", "Total Rent"]
+# (minimum, maximum) per column, None means unbounded
+VALUE_RANGES = {
+    "Property ID": (1, None),
+    "Unit Count": (0, None),
+    "Occupancy Rate": (0, 1),
+    "Total Rent": (0, None),
+}
+MAX_LENGTHS = {
+    name: int(re.search(r"\((\d+)\)", sql_type).group(1))
+    for name, sql_type in TABLE_COLUMNS if sql_type.startswith("NVARCHAR(")
+}
+YEAR_MONTH_PATTERN = r"[0-9]{4}-(0[1-9]|1[0-2])"
+# Largest relative change against the same property's previous month before a row is flagged
+ANOMALY_THRESHOLDS = {
+    "Total Rent": float(os.getenv("VALIDATION_MAX_RENT_CHANGE", "0.3")),
+    "Unit Count": float(os.getenv("VALIDATION_MAX_UNIT_CHANGE", "0.2")),
+}
+
+VIOLATION_COLUMNS = ["row", "Year-Month", "Property ID", "column", "rule", "severity", "message"]
+
+ValidationResult = namedtuple("ValidationResult", ["frame", "violations"])
+
+
+def _violations(frame, mask, column, rule, message, severity="error"):
+    # One violation per row where mask is True; message is a string or a Series aligned with frame
+    mask = mask.fillna(False).astype(bool)
+    if not mask.any():
+        return None
+    flagged = frame.loc[mask]
+    return pd.DataFrame({
+        "row": flagged.index,
+        "Year-Month": flagged["Year-Month"].to_numpy(),
+        "Property ID": flagged["Property ID"].to_numpy(),
+        "column": column,
+        "rule": rule,
+        "severity": severity,
+        "message": message[mask].to_numpy() if isinstance(message, pd.Series) else message,
+    })
+
+
+def _per_value(values, func):
+    # Apply a string check to each distinct value only (months, names repeat a lot), then broadcast;
+    # missing values give NaN
+    codes, uniques = pd.factorize(values)
+    results = func(pd.Series(uniques, dtype=object).astype(str)).to_numpy()
+    return pd.Series(np.where(codes >= 0, results[codes] if len(results) else np.nan, np.nan), index=values.index)
+
+
+def _is_blank(values):
+    return values.isna() | _per_value(values, lambda text: text.str.strip().eq("")).eq(True)
+
+
+def coerce_frame(frame):
+    # Table types without raising: unparseable numbers become NaN and are reported by validate_frame
+    coerced = frame.reindex(columns=list(dict.fromkeys(list(frame.columns) + REQUIRED_COLUMNS + NUMERIC_COLUMNS))).copy()
+    year_month = coerced["Year-Month"]
+    coerced["Year-Month"] = year_month.astype(object).where(year_month.isna(), year_month.astype(str).str.strip())
+    for column in NUMERIC_COLUMNS:
+        coerced[column] = pd.to_numeric(coerced[column], errors="coerce")
+    return coerced
+
+
+def _month_number(year_month):
+    # 2025-04 -> 2025 * 12 + 3, consecutive months differ by one
+    def month_number(text):
+        parts = text.str.extract(r"^([0-9]{4})-([0-9]{2})$").astype(float)
+        return parts[0] * 12 + parts[1] - 1
+    return _per_value(year_month, month_number).astype(float)
+
+
+def _month_over_month(coerced, reference):
+    # Compare every row with the same Property ID one month earlier, taken from the frame itself
+    # or from the reference rows (e.g. the stored previous month), in one merge
+    history = coerced if reference is None else pd.concat([coerce_frame(reference), coerced], ignore_index=True)
+    history = history.assign(_month=_month_number(history["Year-Month"]).to_numpy())
+    history = history.dropna(subset=["_month", "Property ID"]).drop_duplicates(subset=KEY_COLUMNS, keep="last")
+    previous = history[["Property ID", "_month", "Year-Month"] + list(ANOMALY_THRESHOLDS)].assign(_month=lambda h: h["_month"] + 1)
+
+    current = coerced.assign(_month=_month_number(coerced["Year-Month"]).to_numpy(), _row=coerced.index)
+    paired = current.merge(previous, on=["Property ID", "_month"], how="inner", suffixes=("", "_previous"))
+
+    results = []
+    for column, threshold in ANOMALY_THRESHOLDS.items():
+        before, after = paired[f"{column}_previous"], paired[column]
+        change = (after - before) / before.abs().replace(0, np.nan)
+        flagged = change.abs() > threshold
+        if not flagged.any():
+            continue
+        rows = paired[flagged]
+        results.append(pd.DataFrame({
+            "row": rows["_row"].to_numpy(),
+            "Year-Month": rows["Year-Month"].to_numpy(),
+            "Property ID": rows["Property ID"].to_numpy(),
+            "column": column,
+            "rule": "month_over_month",
+            "severity": "warning",
+            # Only the flagged rows get a formatted message
+            "message": [
+                f"{column} changed by {rate:+.0%} from {month} ({old:,.2f} -> {new:,.2f})"
+                for rate, month, old, new in zip(change[flagged], rows["Year-Month_previous"], before[flagged], after[flagged])
+            ],
+        }))
+    return results
+
+
+def validate_frame(frame, reference=None):
+    # Check every row against every rule in one pass; returns the coerced frame and all violations.
+    # "row" in the violations is the frame's index label of the offending row.
+    labels = frame.index
+    frame = frame.reset_index(drop=True)
+    coerced = coerce_frame(frame)
+    results = []
+
+    for column in REQUIRED_COLUMNS:
+        results.append(_violations(coerced, _is_blank(frame[column]) if column in frame.columns else pd.Series(True, index=frame.index),
+                                   column, "required", f"{column} is required"))
+
+    for column in NUMERIC_COLUMNS:
+        if column not in frame.columns:
+            continue
+        not_a_number = frame[column].notna() & ~_is_blank(frame[column]) & coerced[column].isna()
+        results.append(_violations(coerced, not_a_number, column, "type", f"{column} must be a number"))
+        if column in INTEGER_COLUMNS:
+            results.append(_violations(coerced, coerced[column].notna() & (coerced[column] % 1 != 0), column, "type", f"{column} must be a whole number"))
+
+    results.append(_violations(
+        coerced, _per_value(coerced["Year-Month"], lambda text: ~text.str.fullmatch(YEAR_MONTH_PATTERN)).eq(True),
+        "Year-Month", "format", "Year-Month must be in YYYY-MM format"))
+
+    for column, (minimum, maximum) in VALUE_RANGES.items():
+        values = coerced[column]
+        if minimum is not None and maximum is not None:
+            results.append(_violations(coerced, (values < minimum) | (values > maximum), column, "range", f"{column} must be between {minimum} and {maximum}"))
+        elif minimum is not None:
+            results.append(_violations(coerced, values < minimum, column, "range", f"{column} must be at least {minimum}"))
+
+    for column, max_length in MAX_LENGTHS.items():
+        if column in frame.columns:
+            results.append(_violations(coerced, _per_value(frame[column], lambda text: text.str.len().gt(max_length)).eq(True),
+                                       column, "length", f"{column} is longer than {max_length} characters"))
+
+    keys = coerced[KEY_COLUMNS].dropna()
+    results.append(_violations(coerced, keys.duplicated(keep=False).reindex(coerced.index, fill_value=False),
+                               "Property ID", "duplicate", "Year-Month and Property ID appear more than once"))
+
+    results.extend(_month_over_month(coerced, reference))
+
+    results = [result for result in results if result is not None]
+    violations = pd.concat(results, ignore_index=True) if results else pd.DataFrame(columns=VIOLATION_COLUMNS)
+    violations = violations.sort_values(["row", "severity"], kind="stable").reset_index(drop=True)
+    violations["row"] = labels[violations["row"].to_numpy(dtype=int)]
+    coerced.index = labels
+    return ValidationResult(coerced, violations)
+
+
+def errors(violations):
+    return violations[violations["severity"] == "error"]
+
+
+def warnings(violations):
+    return violations[violations["severity"] == "warning"]
+
+
+def previous_months(year_months):
+    # The month before each valid YYYY-MM value, for loading the reference rows of validate_frame
+    months = pd.Series(pd.unique(pd.Series(year_months).astype(str)))
+    valid = months[months.str.fullmatch(YEAR_MONTH_PATTERN)]
+    return sorted(str(period - 1) for period in pd.PeriodIndex(valid, freq="M"))
@@ -0,0 +1,78 @@
+import pandas as pd
+
+from audit_log import AuditWriter, field_changes
+from storage_backends import SQLiteBackend
+
+CHANGED_AT = pd.Timestamp("2025-06-01 12:00:00")
+
+
+def row(property_id, **values):
+    return {"Year-Month": "2025-04", "Property ID": property_id, "Property Name": "A", "Unit Count": 50,
+            "Occupancy Rate": 0.9, "Total Rent": 1000.0, "Comment": None, **values}
+
+
+def without_nan(records):
+    # Missing old or new values may come back as NaN, the audit table stores them as NULL
+    return records.astype(object).where(records.notna(), None)
+
+
+def changes(previous, written):
+    records = without_nan(field_changes(pd.DataFrame(previous), pd.DataFrame(written), "me", "editor", CHANGED_AT, "save-1"))
+    return sorted(zip(records["Property ID"], records["Field"], records["Old Value"], records["New Value"]))
+
+
+def test_one_record_per_changed_field():
+    records = without_nan(field_changes(
+        pd.DataFrame([row(1001)]),
+        pd.DataFrame([row(1001, **{"Total Rent": 1100.0, "Unit Count": 52, "Comment": "Corrected"})]),
+        "me", "editor", CHANGED_AT, "save-1",
+    ))
+
+    assert sorted(zip(records["Field"], records["Old Value"], records["New Value"])) == [
+        ("Comment", None, "Corrected"),
+        ("Total Rent", "1000.0", "1100.0"),
+        ("Unit Count", "50", "52"),
+    ]
+    assert (records["Changed By"] == "me").all() and (records["Role"] == "editor").all()
+    assert (records["Changed At"] == CHANGED_AT).all() and (records["Save ID"] == "save-1").all()
+
+
+def test_equal_values_are_not_recorded():
+    # Numbers compare by value, an empty text is the same as no value
+    previous = [row(1001, **{"Unit Count": 50.0, "Comment": None})]
+    written = [row(1001, **{"Unit Count": 50, "Comment": "", "Last Modified By": "me", "Edited": True})]
+
+    assert changes(previous, written) == []
+
+
+def test_inserted_rows_record_every_field_with_a_value():
+    previous = [{"Year-Month": "2025-04", "Property ID": 1003}]
+    written = [row(1003)]
+
+    assert changes(previous, written) == [
+        (1003, "Occupancy Rate", None, "0.9"),
+        (1003, "Property Name", None, "A"),
+        (1003, "Total Rent", None, "1000.0"),
+        (1003, "Unit Count", None, "50"),
+    ]
+
+
+def test_rows_that_were_not_written_are_not_recorded():
+    # A conflicting row is in the saved frame but not in previous
+    previous = [row(1001)]
+    written = [row(1001, **{"Total Rent": 1100.0}), row(1002, **{"Total Rent": 9999.0})]
+
+    assert changes(previous, written) == [(1001, "Total Rent", "1000.0", "1100.0")]
+
+
+def test_writer_appends_the_records_to_the_audit_table(tmp_path):
+    backend = SQLiteBackend(str(tmp_path / "property_export.db"))
+    backend.ensure_table()
+    writer = AuditWriter(backend, batch_size=100, flush_seconds=60)
+    writer.record(pd.DataFrame([row(1001)]), pd.DataFrame([row(1001, **{"Total Rent": 1100.0})]), "me", "editor", "save-1")
+    writer.record(pd.DataFrame([row(1002)]), pd.DataFrame([row(1002)]), "me", "editor", "save-1")
+
+    assert writer.flush(5)
+    assert writer.stats() == {"written": 1, "pending": 0, "error": None}
+    history = backend.read_audit(property_id=1001)
+    assert history[["Field", "Old Value", "New Value", "Save ID"]].values.tolist() == [["Total Rent", "1000.0", "1100.0", "save-1"]]
@@ -0,0 +1,55 @@
+import pandas as pd
+
+from change_detection import detect_changes
+from frame_schema import apply_compact_dtypes, editable_frame
+
+
+def loaded_page():
+    return apply_compact_dtypes(pd.DataFrame({
+        "Year-Month": ["2025-04", "2025-04", "2025-05"],
+        "Property ID": [1001, 1002, 1001],
+        "Unit Count": [50, 60, 50],
+        "Total Rent": [1000.0, 2000.0, 1000.0],
+        "Comment": ["a", None, "c"],
+        "Last Modified By": ["admin", "admin", "admin"],
+        "Edited": [False, False, False],
+    }))
+
+
+def test_classifies_rows_by_key():
+    original = loaded_page()
+    edited = editable_frame(original.copy())
+    edited.loc[1, "Total Rent"] = 2500.0
+    edited = pd.concat([edited.drop(index=2), pd.DataFrame({"Year-Month": ["2025-06"], "Property ID": [1003], "Unit Count": [10]})], ignore_index=True)
+
+    changes = detect_changes(original, edited)
+
+    assert changes.updated["Property ID"].tolist() == [1002]
+    assert changes.inserted["Property ID"].tolist() == [1003]
+    assert list(zip(changes.deleted["Year-Month"], changes.deleted["Property ID"])) == [("2025-05", 1001)]
+    assert changes.unchanged["Property ID"].tolist() == [1001]
+
+
+def test_grid_dtype_changes_are_not_edits():
+    # The grid hands back floats for whole numbers and None or "" for empty text
+    original = loaded_page()
+    edited = original.astype({"Unit Count": "float64", "Comment": object, "Year-Month": str})
+    edited.loc[1, "Comment"] = ""
+
+    changes = detect_changes(original, edited)
+
+    assert changes.updated.empty and changes.inserted.empty and changes.deleted.empty
+    assert len(changes.unchanged) == 3
+
+
+def test_bookkeeping_columns_are_ignored_and_keyless_rows_dropped():
+    original = loaded_page()
+    edited = original.copy()
+    edited["Edited"] = True
+    edited["Last Modified By"] = "someone else"
+    edited = pd.concat([edited, pd.DataFrame({"Year-Month": [None], "Property ID": [None], "Unit Count": [5]})], ignore_index=True)
+
+    changes = detect_changes(original, edited)
+
+    assert changes.updated.empty and changes.inserted.empty
+    assert len(changes.unchanged) == 3
@@ -0,0 +1,64 @@
+import os
+import tempfile
+
+import pandas as pd
+import pytest
+
+from exporters import EXPORT_COLUMNS, ExportTooLarge, SapField, SapValueTooWide, _format_sap_field, frame_chunks, write_excel_stream
+from synthetic_data import generate_property_data
+
+
+@pytest.fixture
+def temp_dir(tmp_path, monkeypatch):
+    # openpyxl and the spooled output create their temp files here
+    monkeypatch.setattr(tempfile, "tempdir", str(tmp_path))
+    return tmp_path
+
+
+def test_excel_export_writes_every_chunk(temp_dir):
+    data = generate_property_data(250)
+    output = write_excel_stream(frame_chunks(data, 100))
+
+    exported = pd.read_excel(output)
+
+    assert list(exported.columns) == EXPORT_COLUMNS
+    assert exported["Property ID"].tolist() == data["Property ID"].tolist()
+    assert os.listdir(temp_dir) == []
+
+
+@pytest.mark.parametrize("limits", [
+    {"max_rows": 150},
+    # Projected from the worksheet XML before the workbook is saved
+    {"max_bytes": 100 * 1024},
+    # Just below the real size, only the check after saving catches it
+    {"max_bytes": 700 * 1024},
+])
+def test_refused_excel_exports_leave_no_temp_files(temp_dir, limits):
+    with pytest.raises(ExportTooLarge):
+        write_excel_stream(frame_chunks(generate_property_data(15000), 100), **limits)
+    assert os.listdir(temp_dir) == []
+
+
+def test_decimals_are_padded_to_the_field_width():
+    values = pd.Series([1234.5, -7.25, 0.0])
+    field = SapField("Total Rent", 10, "right", "0", 2)
+    assert _format_sap_field(values, field, "").tolist() == ["0001234.50", "-000007.25", "0000000.00"]
+
+
+def test_numbers_wider_than_the_field_raise():
+    values = pd.Series([1.0, 12345678.9])
+    field = SapField("Total Rent", 8, "right", "0", 2)
+    with pytest.raises(SapValueTooWide, match="Total Rent"):
+        _format_sap_field(values, field, "")
+
+
+def test_text_is_cut_and_cleaned():
+    values = pd.Series(["line\nbreak;here", None, "a very long comment"], dtype=object)
+    field = SapField("Comment", 10)
+    assert _format_sap_field(values, field, ";").tolist() == ["line break", "          ", "a very lon"]
+
+
+def test_nullable_integers_leave_missing_values_blank():
+    values = pd.Series([50, pd.NA, -3], dtype="Int32")
+    field = SapField("Unit Count", 6, "right", "0", 0)
+    assert _format_sap_field(values, field, "").tolist() == ["000050", "      ", "-00003"]
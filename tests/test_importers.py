@@ -0,0 +1,85 @@
+import io
+from datetime import datetime
+
+import pandas as pd
+import pytest
+from openpyxl import Workbook
+
+from importers import IMPORT_COLUMNS, InvalidImportFile, upload_chunks
+
+HEADER = ["Year-Month", "Property ID", "Property Name", "Unit Count", "Occupancy Rate", "Total Rent", "Comment"]
+
+
+def data_rows(count):
+    return [("2025-04", 1001 + number, f"Property {number}", 10 + number, 0.9, 1000.0 + number, None) for number in range(count)]
+
+
+def csv_file(rows, header=HEADER):
+    frame = pd.DataFrame(rows, columns=header)
+    return io.BytesIO(frame.to_csv(index=False).encode("utf-8-sig"))
+
+
+def xlsx_file(rows, header=HEADER):
+    workbook = Workbook()
+    sheet = workbook.active
+    sheet.append(header)
+    for row in rows:
+        sheet.append(list(row))
+    file = io.BytesIO()
+    workbook.save(file)
+    file.seek(0)
+    return file
+
+
+def read(file, filename, chunk_size=1000):
+    return [chunk for chunk, _ in upload_chunks(file, filename, chunk_size)]
+
+
+@pytest.mark.parametrize("build, filename", [(csv_file, "rows.csv"), (xlsx_file, "rows.xlsx")])
+def test_short_files_keep_their_columns(build, filename):
+    chunks = read(build(data_rows(2)), filename)
+
+    assert len(chunks) == 1
+    assert list(chunks[0].columns) == IMPORT_COLUMNS
+    assert chunks[0].index.tolist() == [0, 1]
+    assert chunks[0]["Property ID"].astype(int).tolist() == [1001, 1002]
+    assert chunks[0]["Property Name"].tolist() == ["Property 0", "Property 1"]
+
+
+@pytest.mark.parametrize("build, filename", [(csv_file, "rows.csv"), (xlsx_file, "rows.xlsx")])
+def test_chunks_are_numbered_on_across_the_boundary(build, filename):
+    chunks = read(build(data_rows(7)), filename, chunk_size=3)
+
+    assert [len(chunk) for chunk in chunks] == [3, 3, 1]
+    combined = pd.concat(chunks)
+    assert combined.index.tolist() == list(range(7))
+    assert combined["Property ID"].astype(int).tolist() == list(range(1001, 1008))
+    # The tail chunk is as complete as the others
+    assert chunks[-1]["Total Rent"].astype(float).tolist() == [1006.0]
+
+
+@pytest.mark.parametrize("second_month", [datetime(2025, 5, 1), "2025-05"])
+def test_excel_dates_become_year_months(second_month):
+    rows = [(datetime(2025, 4, 1), 1001, "A", 10, 0.9, 1000.0, None), (second_month, 1001, "A", 10, 0.9, 1000.0, None)]
+    chunks = read(xlsx_file(rows), "rows.xlsx")
+    assert chunks[0]["Year-Month"].tolist() == ["2025-04", "2025-05"]
+
+
+def test_headers_are_matched_without_spaces_and_extra_columns_dropped():
+    header = [f" {name} " for name in HEADER] + ["Notes"]
+    rows = [row + ("ignored",) for row in data_rows(1)]
+    chunks = read(csv_file(rows, header), "rows.csv")
+    assert list(chunks[0].columns) == IMPORT_COLUMNS
+
+
+@pytest.mark.parametrize("build, filename", [(csv_file, "rows.csv"), (xlsx_file, "rows.xlsx")])
+def test_missing_key_columns_are_refused(build, filename):
+    header = [name for name in HEADER if name != "Property ID"]
+    rows = [row[:1] + row[2:] for row in data_rows(1)]
+    with pytest.raises(InvalidImportFile, match="Property ID"):
+        read(build(rows, header), filename)
+
+
+def test_unsupported_files_are_refused():
+    with pytest.raises(InvalidImportFile, match="Unsupported"):
+        upload_chunks(io.BytesIO(b""), "rows.json")
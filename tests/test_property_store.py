@@ -0,0 +1,101 @@
+import re
+import warnings
+
+import pandas as pd
+import pytest
+
+import property_store
+from property_store import TABLE_COLUMNS, bulk_upsert
+
+
+class RecordingConnection:
+    """DB-API stand-in for a pyodbc connection that records every statement with the autocommit mode it ran in."""
+
+    def __init__(self):
+        self.autocommit = False
+        self.log = []
+
+    def cursor(self):
+        return RecordingCursor(self)
+
+    def commit(self):
+        self.log.append((self.autocommit, "COMMIT"))
+
+    def rollback(self):
+        self.log.append((self.autocommit, "ROLLBACK"))
+
+
+class RecordingCursor:
+    # Every query returns no rows, shaped like the table
+    description = [(name, None, None, None, None, None, None) for name, _ in TABLE_COLUMNS]
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.fast_executemany = False
+
+    def execute(self, sql, *params):
+        self.conn.log.append((self.conn.autocommit, " ".join(sql.split())))
+        return self
+
+    def executemany(self, sql, rows):
+        self.execute(sql)
+
+    def fetchone(self):
+        return (0, 0)
+
+    def fetchall(self):
+        return []
+
+    def close(self):
+        pass
+
+
+def statements(conn, pattern):
+    return [(autocommit, sql) for autocommit, sql in conn.log if re.match(pattern, sql)]
+
+
+def upsert(conn):
+    frame = pd.DataFrame({"Year-Month": ["2025-04"], "Property ID": [1001], "Property Name": ["A"], "Edited": [True], "Row Version": [1]})
+    with warnings.catch_warnings():
+        # pandas only knows SQLAlchemy and sqlite3 connections and warns about any other DB-API connection
+        warnings.simplefilter("ignore", UserWarning)
+        return bulk_upsert(conn, "[dbo].[PropertyExport]", frame, "me")
+
+
+def test_temp_tables_are_created_and_dropped_outside_the_transaction():
+    conn = RecordingConnection()
+    upsert(conn)
+
+    ddl = statements(conn, r"(IF OBJECT_ID\('tempdb.*)?(CREATE|DROP) TABLE")
+    assert len(ddl) == 6
+    assert all(autocommit for autocommit, _ in ddl)
+    writes = statements(conn, r"(MERGE|INSERT INTO #PropertyExportRollupDelta)")
+    assert len(writes) == 3
+    assert not any(autocommit for autocommit, _ in writes)
+    # Committed before the temp tables are dropped, and handed back without autocommit
+    sqls = [sql for _, sql in conn.log]
+    assert sqls.index("COMMIT") > max(sqls.index(sql) for _, sql in writes)
+    assert sqls.index("COMMIT") < sqls.index("DROP TABLE #PropertyExportStaging")
+    assert conn.autocommit is False
+
+
+def test_failed_writes_are_rolled_back(monkeypatch):
+    conn = RecordingConnection()
+
+    def failing_merge(*args):
+        raise RuntimeError("merge failed")
+
+    monkeypatch.setattr(property_store, "_apply_rollup_deltas", failing_merge)
+    with pytest.raises(RuntimeError):
+        upsert(conn)
+    assert conn.log[-1] == (False, "ROLLBACK")
+    assert not statements(conn, "COMMIT")
+
+
+def test_the_lock_row_is_taken_before_anything_is_read():
+    conn = RecordingConnection()
+    upsert(conn)
+
+    in_transaction = [sql for autocommit, sql in conn.log if not autocommit]
+    assert in_transaction[0].startswith("UPDATE [dbo].[PropertyExportLock] SET [Locked At]")
+    assert in_transaction[-1] == "COMMIT"
@@ -0,0 +1,69 @@
+import pandas as pd
+
+from query_cache import QueryCache
+
+
+def test_hits_and_misses_are_counted():
+    cache = QueryCache(ttl_seconds=60, max_bytes=1024 * 1024)
+    loads = []
+
+    def loader():
+        loads.append(1)
+        return ["2025-04", "2025-05"]
+
+    assert cache.get_or_load(("months",), loader, "PropertyExport") == ["2025-04", "2025-05"]
+    assert cache.get_or_load(("months",), loader, "PropertyExport") == ["2025-04", "2025-05"]
+    assert cache.get_or_load(("months",), loader, "PropertyExport") == ["2025-04", "2025-05"]
+
+    assert len(loads) == 1
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (2, 1, 1)
+    assert stats["hit_rate"] == 2 / 3
+
+
+def test_expired_entries_are_misses():
+    cache = QueryCache(ttl_seconds=0, max_bytes=1024 * 1024)
+    cache.put("key", 1, "PropertyExport")
+
+    assert cache.get("key") == (False, None)
+    assert cache.stats()["entries"] == 0
+
+
+def test_invalidate_drops_the_saved_months_and_results_across_months():
+    cache = QueryCache(ttl_seconds=60, max_bytes=1024 * 1024)
+    cache.put("april", 1, "PropertyExport", "2025-04")
+    cache.put("may", 2, "PropertyExport", "2025-05")
+    cache.put("all", 3, "PropertyExport")
+    cache.put("other table", 4, "OtherExport", "2025-04")
+
+    assert cache.invalidate("PropertyExport", ["2025-04"]) == 2
+
+    assert cache.get("april") == (False, None)
+    assert cache.get("all") == (False, None)
+    assert cache.get("may") == (True, 2)
+    assert cache.get("other table") == (True, 4)
+    assert cache.stats()["invalidations"] == 2
+
+
+def test_invalidate_without_months_drops_the_whole_table():
+    cache = QueryCache(ttl_seconds=60, max_bytes=1024 * 1024)
+    cache.put("april", 1, "PropertyExport", "2025-04")
+    cache.put("may", 2, "PropertyExport", "2025-05")
+
+    assert cache.invalidate("PropertyExport") == 2
+    assert cache.stats()["entries"] == 0
+
+
+def test_least_recently_used_entries_are_evicted_over_the_size_limit():
+    frame = pd.DataFrame({"Total Rent": range(1000)})
+    size = int(frame.memory_usage(index=True, deep=True).sum())
+    cache = QueryCache(ttl_seconds=60, max_bytes=2 * size)
+    cache.put("first", frame, "PropertyExport")
+    cache.put("second", frame, "PropertyExport")
+    cache.get("first")
+    cache.put("third", frame, "PropertyExport")
+
+    assert cache.get("second") == (False, None)
+    assert cache.get("first")[0] and cache.get("third")[0]
+    assert cache.stats()["evictions"] == 1
+    assert cache.stats()["bytes"] <= 2 * size
@@ -0,0 +1,71 @@
+import time
+
+import pytest
+
+import audit_log
+from save_jobs import get_save_job, submit_save_job
+from storage_backends import SQLiteBackend
+from synthetic_data import generate_property_data
+
+
+@pytest.fixture
+def backend(tmp_path, monkeypatch):
+    # Audit writers are kept per backend name and table, every test gets its own
+    writers = {}
+    monkeypatch.setattr(audit_log, "_writers", writers)
+    backend = SQLiteBackend(str(tmp_path / "property_export.db"))
+    backend.ensure_table()
+    backend.bulk_upsert(generate_property_data(5, months=1).assign(Edited=True), "loader", check_version=False)
+    yield backend
+    for writer in writers.values():
+        writer.flush(5)
+
+
+def wait(job, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not job.finished:
+        assert time.monotonic() < deadline, "save job did not finish"
+        time.sleep(0.01)
+    return job.status()
+
+
+def edited(backend):
+    loaded = backend.read_frame()
+    return loaded.assign(**{"Total Rent": loaded["Total Rent"] + 100.0, "Edited": True})
+
+
+def test_save_is_written_in_batches(backend):
+    committed = []
+    job = submit_save_job(backend, edited(backend), "me", batch_size=2, on_commit=lambda batch: committed.append(len(batch)))
+    status = wait(job)
+
+    assert get_save_job(job.id) is job
+    assert committed == [2, 2, 1]
+    assert (status["state"], status["progress"], status["batches_committed"]) == ("done", 1.0, 3)
+    assert (status["updates_count"], status["inserts_count"], status["conflicts_count"]) == (5, 0, 0)
+    assert [stats["rows"] for stats in status["batch_stats"]] == [2, 2, 1]
+    assert (backend.read_frame()["Last Modified By"] == "me").all()
+
+
+def test_cancel_keeps_the_committed_batches(backend):
+    before = backend.read_frame()["Total Rent"].tolist()
+    job = None
+
+    def cancel_after_first_batch(batch):
+        job.cancel()
+
+    frame = edited(backend)
+    job = submit_save_job(backend, frame, "me", batch_size=2, on_commit=cancel_after_first_batch)
+    status = wait(job)
+
+    assert (status["state"], status["rows_done"], status["batches_committed"]) == ("cancelled", 2, 1)
+    assert backend.read_frame()["Total Rent"].tolist() == frame["Total Rent"].tolist()[:2] + before[2:]
+
+
+def test_failed_batch_fails_the_job(backend):
+    frame = edited(backend).drop(columns=["Property ID"])
+    status = wait(submit_save_job(backend, frame, "me", batch_size=2))
+
+    assert status["state"] == "failed"
+    assert status["error"]
+    assert status["batches_committed"] == 0
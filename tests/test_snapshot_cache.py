@@ -0,0 +1,100 @@
+import os
+import sqlite3
+from contextlib import closing
+
+import pandas as pd
+import pytest
+
+from snapshot_cache import SnapshotCache
+from storage_backends import SQLiteBackend
+
+
+@pytest.fixture
+def backend(tmp_path):
+    backend = SQLiteBackend(str(tmp_path / "property_export.db"))
+    backend.ensure_table()
+    backend.bulk_upsert(pd.DataFrame({
+        "Year-Month": ["2025-04", "2025-04", "2025-05"],
+        "Property ID": [1001, 1002, 1001],
+        "Property Name": ["A", "B", "A"],
+        "Unit Count": [50, 60, 50],
+        "Occupancy Rate": [0.9, 0.8, 1.0],
+        "Total Rent": [1000.0, 2000.0, 1500.0],
+        "Edited": True,
+    }), "loader", check_version=False)
+    return backend
+
+
+@pytest.fixture
+def snapshot(tmp_path):
+    return SnapshotCache(str(tmp_path / "snapshot"), "PropertyExport")
+
+
+def external(backend, sql, params=()):
+    # A write made by another tool, which does not touch [Modified At]
+    with closing(sqlite3.connect(backend.path)) as conn:
+        conn.execute(sql, params)
+        conn.commit()
+
+
+def test_first_sync_fetches_every_month(backend, snapshot):
+    assert snapshot.sync(backend) == ["2025-04", "2025-05"]
+    assert snapshot.distinct_values("Year-Month") == ["2025-04", "2025-05"]
+    assert snapshot.count_rows() == (3, 3)
+    assert snapshot.sync(backend) == []
+
+
+def test_app_save_refreshes_its_month(backend, snapshot):
+    snapshot.sync(backend)
+    loaded = backend.read_frame("2025-05")
+    backend.bulk_upsert(loaded.assign(**{"Total Rent": 1600.0, "Edited": True}), "me")
+
+    assert snapshot.sync(backend) == ["2025-05"]
+    assert snapshot.read_frame("2025-05")["Total Rent"].tolist() == [1600.0]
+
+
+def test_external_update_is_picked_up(backend, snapshot):
+    snapshot.sync(backend)
+    external(backend, 'UPDATE "PropertyExport" SET "Total Rent" = 1100.0 WHERE "Property ID" = 1001 AND "Year-Month" = ?', ("2025-04",))
+
+    assert snapshot.sync(backend) == ["2025-04"]
+    assert snapshot.read_frame("2025-04", 1001)["Total Rent"].tolist() == [1100.0]
+
+
+def test_external_insert_into_a_known_month_is_picked_up(backend, snapshot):
+    snapshot.sync(backend)
+    external(backend, 'INSERT INTO "PropertyExport" ("Year-Month", "Property ID", "Total Rent") VALUES (?, ?, ?)', ("2025-05", 1003, 700.0))
+
+    assert snapshot.sync(backend) == ["2025-05"]
+    assert snapshot.read_frame("2025-05")["Property ID"].tolist() == [1001, 1003]
+
+
+def test_rows_without_a_watermark_are_stamped(backend):
+    external(backend, 'UPDATE "PropertyExport" SET "Modified At" = NULL')
+    SQLiteBackend(backend.path).ensure_table()
+
+    assert backend.read_frame()["Modified At"].notna().all()
+
+
+def test_deleted_month_is_removed(backend, snapshot):
+    snapshot.sync(backend)
+    external(backend, 'DELETE FROM "PropertyExport" WHERE "Year-Month" = ?', ("2025-05",))
+
+    assert snapshot.sync(backend) == []
+    assert snapshot.distinct_values("Year-Month") == ["2025-04"]
+    assert not os.path.exists(os.path.join(snapshot.directory, "2025-05.parquet"))
+
+
+def test_periodic_full_refresh(backend, tmp_path):
+    snapshot = SnapshotCache(str(tmp_path / "snapshot"), "PropertyExport", full_refresh_seconds=0)
+    snapshot.sync(backend)
+
+    assert snapshot.sync(backend) == ["2025-04", "2025-05"]
+
+
+def test_sync_leaves_no_temp_files(backend, snapshot):
+    snapshot.sync(backend)
+    external(backend, 'UPDATE "PropertyExport" SET "Total Rent" = 0.0')
+    snapshot.sync(backend)
+
+    assert sorted(os.listdir(snapshot.directory)) == ["2025-04.parquet", "2025-05.parquet", "_state.json"]
@@ -0,0 +1,110 @@
+import sqlite3
+from contextlib import closing
+
+import pandas as pd
+import pytest
+
+from storage_backends import SQLiteBackend
+
+
+@pytest.fixture
+def backend(tmp_path):
+    backend = SQLiteBackend(str(tmp_path / "property_export.db"))
+    backend.ensure_table()
+    backend.bulk_upsert(pd.DataFrame({
+        "Year-Month": ["2025-04", "2025-04", "2025-05"],
+        "Property ID": [1001, 1002, 1001],
+        "Property Name": ["A", "B", "A"],
+        "Unit Count": [50, 60, 50],
+        "Occupancy Rate": [0.9, 0.8, 1.0],
+        "Total Rent": [1000.0, 2000.0, 1500.0],
+        "Edited": True,
+    }), "loader", check_version=False)
+    return backend
+
+
+def totals(backend):
+    return backend.read_rollup().set_index("Year-Month")
+
+
+def assert_rollup_matches_table(backend):
+    kept = totals(backend)
+    backend.rebuild_rollup()
+    pd.testing.assert_frame_equal(kept, totals(backend))
+
+
+def test_reads_do_not_create_the_rollup_or_audit_tables(tmp_path):
+    backend = SQLiteBackend(str(tmp_path / "property_export.db"))
+
+    assert backend.read_rollup().empty
+    assert list(backend.read_rollup().columns) == ["Year-Month", "Property Count", "Total Rent", "Average Occupancy Rate", "Unit Count"]
+    assert backend.read_audit(property_id=1001).empty
+    assert not backend.table_exists()
+    with closing(sqlite3.connect(backend.path)) as conn:
+        assert conn.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()[0] == 0
+
+
+def test_reads_by_filter_and_page(backend):
+    assert backend.distinct_values("Year-Month") == ["2025-04", "2025-05"]
+    assert backend.count_rows("2025-04") == (2, 3)
+    assert backend.read_page(after_key=("2025-04", 1001), page_size=1)["Property ID"].tolist() == [1002]
+    chunks = list(backend.read_chunks(chunk_size=2))
+    assert [len(chunk) for chunk in chunks] == [2, 1]
+
+
+def test_unedited_rows_are_not_written(backend):
+    loaded = backend.read_frame("2025-05")
+    result = backend.bulk_upsert(loaded.assign(**{"Total Rent": 9999.0, "Edited": False}), "me")
+    assert (result.updates_count, result.inserts_count, len(result.conflicts)) == (0, 0, 0)
+    assert backend.read_frame("2025-05")["Total Rent"].tolist() == [1500.0]
+
+
+def test_stale_rows_are_returned_as_conflicts(backend):
+    loaded = backend.read_frame("2025-04")
+    # Someone else saves property 1001 after it was loaded
+    backend.bulk_upsert(loaded.iloc[[0]].assign(**{"Total Rent": 1100.0, "Edited": True}), "other")
+
+    result = backend.bulk_upsert(loaded.assign(**{"Total Rent": [1200.0, 2200.0], "Edited": True}), "me")
+
+    assert (result.updates_count, result.inserts_count) == (1, 0)
+    assert result.conflicts["Property ID"].tolist() == [1001]
+    assert result.conflicts["Total Rent"].tolist() == [1100.0]
+    assert result.previous["Property ID"].tolist() == [1002]
+    stored = backend.read_frame("2025-04").set_index("Property ID")["Total Rent"]
+    assert stored.to_dict() == {1001: 1100.0, 1002: 2200.0}
+
+
+def test_versions_are_ignored_without_check_version(backend):
+    loaded = backend.read_frame("2025-04")
+    backend.bulk_upsert(loaded.iloc[[0]].assign(**{"Total Rent": 1100.0, "Edited": True}), "other")
+
+    result = backend.bulk_upsert(loaded.iloc[[0]].assign(**{"Total Rent": 1200.0, "Edited": True}), "import", check_version=False)
+
+    assert (result.updates_count, len(result.conflicts)) == (1, 0)
+    stored = backend.read_frame("2025-04").set_index("Property ID")
+    assert stored.loc[1001, "Total Rent"] == 1200.0
+    assert stored.loc[1001, "Row Version"] == 3
+
+
+def test_inserts_fill_the_rollup(backend):
+    assert totals(backend).loc["2025-04", "Property Count"] == 2
+    assert totals(backend).loc["2025-04", "Total Rent"] == 3000.0
+    assert_rollup_matches_table(backend)
+
+
+def test_rollup_moves_by_the_written_rows_only(backend):
+    loaded = backend.read_frame("2025-04")
+    backend.bulk_upsert(loaded.iloc[[0]].assign(**{"Total Rent": 1100.0, "Edited": True}), "other")
+    new_row = pd.DataFrame({"Year-Month": ["2025-04"], "Property ID": [1003], "Property Name": ["C"],
+                            "Unit Count": [5], "Occupancy Rate": [0.5], "Total Rent": [300.0], "Edited": [True]})
+
+    # 1001 conflicts, 1002 changes by +200 and 1003 is new
+    result = backend.bulk_upsert(pd.concat([loaded.assign(**{"Total Rent": [1200.0, 2200.0], "Edited": True}), new_row]), "me")
+
+    assert (result.updates_count, result.inserts_count, len(result.conflicts)) == (1, 1, 1)
+    april = totals(backend).loc["2025-04"]
+    assert april["Property Count"] == 3
+    assert april["Total Rent"] == 1100.0 + 2200.0 + 300.0
+    assert april["Unit Count"] == 50 + 60 + 5
+    assert totals(backend).loc["2025-05", "Total Rent"] == 1500.0
+    assert_rollup_matches_table(backend)
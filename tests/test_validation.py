@@ -0,0 +1,75 @@
+import numpy as np
+import pandas as pd
+
+from validation import errors, previous_months, validate_frame, warnings
+
+
+def rows(**columns):
+    frame = pd.DataFrame({
+        "Year-Month": ["2025-04", "2025-04"],
+        "Property ID": [1001, 1002],
+        "Property Name": ["A", "B"],
+        "Unit Count": [50, 60],
+        "Occupancy Rate": [0.9, 0.8],
+        "Total Rent": [1000.0, 2000.0],
+    })
+    for name, values in columns.items():
+        frame[name] = values
+    return frame
+
+
+def problems(violations):
+    return sorted(zip(violations["row"], violations["column"], violations["rule"]))
+
+
+def test_valid_rows_pass():
+    result = validate_frame(rows())
+    assert result.violations.empty
+    assert result.frame["Unit Count"].tolist() == [50, 60]
+
+
+def test_every_rule_reports_the_offending_row():
+    frame = rows(**{
+        "Year-Month": ["2025-13", "2025-04"],
+        "Property Name": ["  ", "B"],
+        "Unit Count": ["many", 2.5],
+        "Occupancy Rate": [0.9, 1.5],
+    })
+    assert problems(validate_frame(frame).violations) == [
+        (0, "Property Name", "required"),
+        (0, "Unit Count", "type"),
+        (0, "Year-Month", "format"),
+        (1, "Occupancy Rate", "range"),
+        (1, "Unit Count", "type"),
+    ]
+
+
+def test_missing_whole_numbers_are_not_type_errors():
+    # NaN % 1 is NaN, an empty Unit Count must not be reported as "must be a whole number"
+    frame = rows(**{"Unit Count": [np.nan, None]})
+    assert validate_frame(frame).violations.empty
+
+    frame = rows(**{"Unit Count": pd.array([pd.NA, 3], dtype="Int32")})
+    assert validate_frame(frame).violations.empty
+
+
+def test_duplicate_keys_are_errors():
+    frame = rows(**{"Property ID": [1001, 1001]})
+    assert problems(errors(validate_frame(frame).violations)) == [(0, "Property ID", "duplicate"), (1, "Property ID", "duplicate")]
+
+
+def test_violations_use_the_frame_index():
+    frame = rows(**{"Occupancy Rate": [0.9, 2.0]})
+    frame.index = [10, 20]
+    assert validate_frame(frame).violations["row"].tolist() == [20]
+
+
+def test_month_over_month_changes_are_warnings():
+    reference = rows(**{"Year-Month": ["2025-03", "2025-03"]})
+    frame = rows(**{"Total Rent": [1000.0, 4000.0]})
+
+    violations = validate_frame(frame, reference).violations
+
+    assert errors(violations).empty
+    assert problems(warnings(violations)) == [(1, "Total Rent", "month_over_month")]
+    assert previous_months(frame["Year-Month"]) == ["2025-03"]